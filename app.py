@@ -1,66 +1,346 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, flash, session, has_request_context,
+                   Response, send_file, send_from_directory, abort)
+from jinja2 import FileSystemBytecodeCache
+import atexit
+import concurrent.futures
+import mimetypes
+import multiprocessing
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
 import os
-from datetime import datetime
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import click
+
+import archiving
+import assets
+import client360
+import documents
+import duplicates
+import exposure
+import premium
+import replication
+import reporting
+import repositories
+import sharding
+import tariffs
+import writequeue
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['DATABASE'] = 'data.db'
+# 'float' keeps the legacy SQL REAL calculation, 'fixed' uses integer BIF arithmetic
+app.config['PRIME_ARITHMETIC'] = os.environ.get('PRIME_ARITHMETIC', 'float')
+app.config['REPORT_SNAPSHOT_PATH'] = os.path.join(app.instance_path, 'reports', 'premium_snapshot.json.gz')
+# Report snapshots are never taken from the live database between these hours (Mon-Fri)
+app.config['REPORT_BUSINESS_HOURS'] = (7, 18)
+# Seconds a built reference data bundle is reused before it is rebuilt from the database
+app.config['REFERENCE_DATA_TTL'] = 300
+# Optional per-agency storage: client books in instance/shards, reference data in DATABASE
+app.config['SHARDING'] = os.environ.get('SHARDING') == '1'
+app.config['SHARD_DIR'] = os.path.join(app.instance_path, 'shards')
+app.config['DEFAULT_AGENCY_ID'] = 1
+# Optional read replica for listing routes (single database mode only)
+app.config['READ_REPLICA'] = os.environ.get('READ_REPLICA') == '1'
+app.config['REPLICA_PATH'] = os.path.join(app.instance_path, 'replica', 'data.db')
+app.config['REPLICA_REFRESH_INTERVAL'] = 2  # seconds between replica copies
+app.config['REPLICA_MAX_STALENESS'] = 10  # older replicas are bypassed for the primary
+# Superseded prime calculations older than this move to the yearly archives in ARCHIVE_DIR
+app.config['ARCHIVE_RETENTION_DAYS'] = 30
+app.config['ARCHIVE_DIR'] = os.path.join(app.instance_path, 'archive')
+# Rendered policy documents, cached by content hash, and the zips of bulk document jobs
+app.config['DOCUMENT_CACHE_DIR'] = os.path.join(app.instance_path, 'documents', 'cache')
+app.config['DOCUMENT_JOB_DIR'] = os.path.join(app.instance_path, 'documents', 'jobs')
+app.config['DOCUMENT_WORKERS'] = os.cpu_count() or 1
+app.config['DOCUMENT_JOB_TTL'] = 24 * 3600  # seconds a bulk job zip stays available for download
+# Precompiled templates, written by `flask build-assets` and loaded at startup when present
+app.config['TEMPLATE_CACHE_DIR'] = os.path.join(app.instance_path, 'jinja')
+# Fingerprinted static assets never change, browsers may keep them for a year
+app.config['ASSET_MAX_AGE'] = 365 * 24 * 3600
+# Optional group commit of prime calculation audit rows by one writer thread per database
+app.config['WRITE_QUEUE'] = os.environ.get('WRITE_QUEUE') == '1'
+app.config['WRITE_QUEUE_MAX_BATCH'] = 500  # writes per transaction
+app.config['WRITE_QUEUE_MAX_DELAY'] = 0.005  # seconds the writer waits to fill a batch
+app.config['WRITE_QUEUE_MAX_PENDING'] = 10000  # queued writes before submitters are held back
+# Wait for the group commit before responding; off acknowledges writes that a crash can still lose
+app.config['WRITE_QUEUE_DURABLE'] = True
+app.config['WRITE_QUEUE_RESULT_TIMEOUT'] = 10  # seconds to wait for the commit before writing directly
+# Idle connections kept open per database, so sqlite3's per-connection statement cache is reused
+app.config['DB_POOL_SIZE'] = 8
+
+_reference_bundle = {'built_at': 0, 'bundle': None}
+_replica = {}
+_tarif_index = {'built_at': 0, 'index': None}
+_exposure_ready = []
+_book_schema_ready = set()
+_duplicates_ready = []
+_asset_manifest = {}
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+_idle_connections = {}
+_idle_connections_lock = threading.Lock()
+
+
+def get_replica():
+    if 'replica' not in _replica:
+        _replica['replica'] = replication.Replica(app.config['DATABASE'],
+                                                  app.config['REPLICA_PATH'],
+                                                  app.config['REPLICA_REFRESH_INTERVAL'],
+                                                  app.config['REPLICA_MAX_STALENESS'])
+    return _replica['replica']
+
+
+def checkout_connection(agency_id=None):
+    """An idle connection to the primary database or an agency shard, or a new one"""
+    sharded = app.config['SHARDING'] and agency_id is not None
+    # Connections are not carried over a fork, and tests may point DATABASE elsewhere
+    key = (os.getpid(), app.config['DATABASE'], app.config['SHARD_DIR'] if sharded else None,
+           agency_id if sharded else None)
+    with _idle_connections_lock:
+        idle = _idle_connections.setdefault(key, [])
+        if idle:
+            return key, idle.pop()
+
+    if sharded:
+        conn = sharding.connect_shard(app.config['SHARD_DIR'], agency_id, app.config['DATABASE'],
+                                      check_same_thread=False)
+    else:
+        conn = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    return key, conn
+
+
+def release_connection(key, conn):
+    """Return a connection for reuse, dropping anything its user left uncommitted"""
+    if conn.in_transaction:
+        conn.rollback()
+    with _idle_connections_lock:
+        idle = _idle_connections.setdefault(key, [])
+        if len(idle) < app.config['DB_POOL_SIZE']:
+            idle.append(conn)
+            return
+    conn.close()
 
 
 # Database connection helper
 @contextmanager
-def get_db_connection():
-    conn = sqlite3.connect('data.db')
+def get_db_connection(agency_id=None, read_only=False):
+    conn = None
+    key = None
+    if read_only and app.config['READ_REPLICA'] and not app.config['SHARDING']:
+        # Users who just wrote read the primary until the replica has caught up with them
+        last_write_at = session.get('last_write_at', 0) if has_request_context() else 0
+        conn = get_replica().connect(min_refreshed_at=last_write_at)
+    if conn is None:
+        key, conn = checkout_connection(agency_id)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    changes = conn.total_changes
+    reusable = False
     try:
         yield conn
+        reusable = key is not None
     finally:
-        conn.close()
+        if conn.total_changes != changes and has_request_context():
+            session['last_write_at'] = time.time()
+        # Replica connections are not pooled, the replica file is swapped under them
+        if reusable:
+            release_connection(key, conn)
+        else:
+            conn.close()
+
+
+def get_asset_manifest():
+    """Static file name -> fingerprinted name from the last asset build, loaded once per process"""
+    if 'files' not in _asset_manifest:
+        files = assets.load_manifest(app.static_folder)
+        _asset_manifest.update(files=files, fingerprinted=set(files.values()))
+    return _asset_manifest
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    """Point url_for('static', filename=...) at the fingerprinted copy when there is one"""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = get_asset_manifest()['files'].get(values['filename'], values['filename'])
+
+
+def serve_static(filename):
+    """Static files, with fingerprinted ones precompressed and cached as immutable"""
+    if filename not in get_asset_manifest()['fingerprinted']:
+        return app.send_static_file(filename)
+
+    variant, encoding = assets.precompressed(app.static_folder, filename,
+                                             request.headers.get('Accept-Encoding'))
+    response = send_from_directory(app.static_folder, variant, max_age=app.config['ASSET_MAX_AGE'],
+                                   mimetype=mimetypes.guess_type(filename)[0])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+app.view_functions['static'] = serve_static
+
+
+def get_write_queue(agency_id=None):
+    """Group commit queue of the primary database or of an agency shard"""
+    with _write_queues_lock:
+        if agency_id not in _write_queues:
+            def connect():
+                if app.config['SHARDING'] and agency_id is not None:
+                    conn = sharding.connect_shard(app.config['SHARD_DIR'], agency_id, app.config['DATABASE'])
+                else:
+                    conn = sqlite3.connect(app.config['DATABASE'], timeout=30)
+                conn.row_factory = sqlite3.Row
+                return conn
+
+            _write_queues[agency_id] = writequeue.GroupCommitQueue(
+                connect,
+                max_batch=app.config['WRITE_QUEUE_MAX_BATCH'],
+                max_delay=app.config['WRITE_QUEUE_MAX_DELAY'],
+                max_pending=app.config['WRITE_QUEUE_MAX_PENDING'])
+        return _write_queues[agency_id]
+
+
+def queue_write(agency_id, write, *args):
+    """Hand `write(conn, *args)` to the group commit queue.
+
+    Returns False when the queue is off, full or shut down, or when a durable
+    write was not taken up in time; the caller then writes directly.
+    """
+    if not app.config['WRITE_QUEUE']:
+        return False
+    try:
+        future = get_write_queue(agency_id).submit(write, *args)
+    except (queue.Full, writequeue.QueueClosed):
+        return False
+
+    if app.config['WRITE_QUEUE_DURABLE']:
+        try:
+            future.result(app.config['WRITE_QUEUE_RESULT_TIMEOUT'])
+        except concurrent.futures.TimeoutError:
+            # A cancelled write is never run by the queue; one already in a batch is waited for
+            if future.cancel():
+                return False
+            future.result()
+        except writequeue.QueueClosed:
+            return False
+    if has_request_context():
+        session['last_write_at'] = time.time()
+    return True
+
+
+@atexit.register
+def close_write_queues():
+    """Commit every queued write before the process exits"""
+    with _write_queues_lock:
+        write_queues = list(_write_queues.values())
+    for write_queue in write_queues:
+        write_queue.close()
+
+
+def client_shard(client_id):
+    """Agency shard holding a client, None when sharding is off"""
+    if not app.config['SHARDING']:
+        return None
+    agency_id = sharding.locate(app.config['DATABASE'], 'Client', client_id)
+    # Unknown IDs are looked up (and not found) in the default shard
+    return app.config['DEFAULT_AGENCY_ID'] if agency_id is None else agency_id
+
+
+def policy_shard(policy_id):
+    """Agency shard holding a policy, None when sharding is off"""
+    if not app.config['SHARDING']:
+        return None
+    agency_id = sharding.locate(app.config['DATABASE'], 'Policy', policy_id)
+    return app.config['DEFAULT_AGENCY_ID'] if agency_id is None else agency_id
+
+
+def new_client_shard(branch_id):
+    """Agency shard for a new client: its branch when that is an agency, else the default agency"""
+    if not app.config['SHARDING']:
+        return None
+    with get_db_connection() as conn:
+        agency = conn.execute('SELECT AgencyID FROM Agencies WHERE AgencyID = ?', (branch_id,)).fetchone()
+    return agency['AgencyID'] if agency else app.config['DEFAULT_AGENCY_ID']
+
+
+def read_all(read, read_only=False):
+    """Run `read(conn)` over the whole client book, fanning out to every shard when sharded.
+
+    `read` returns a list of rows, typically from a repository. `read_only`
+    lets it be served from the read replica when one is enabled.
+    """
+    if app.config['SHARDING']:
+        return sharding.fan_out(app.config['SHARD_DIR'], app.config['DATABASE'], read)
+
+    with get_db_connection(read_only=read_only) as conn:
+        return read(conn)
+
+
+def query_all(sql, params=(), read_only=False):
+    """Run a read query over the whole client book"""
+    return read_all(lambda conn: conn.execute(sql, params).fetchall(), read_only)
+
+
+def query_page(read_page, sort_key, per_page, offset, reverse=False, read_only=False):
+    """One page of the rows `read_page(conn, limit, offset)` returns in `sort_key` order"""
+    if not app.config['SHARDING']:
+        return read_all(lambda conn: read_page(conn, per_page, offset), read_only)
+
+    # Every shard returns its first offset + per_page rows, the merged order picks the page
+    rows = read_all(lambda conn: read_page(conn, offset + per_page, 0))
+    rows.sort(key=sort_key, reverse=reverse)
+    return rows[offset:offset + per_page]
+
+
+def count_all(repository, read_only=False):
+    """Number of rows of a repository's table over the whole client book"""
+    return sum(read_all(lambda conn: [repository(conn).count()], read_only))
 
 
 def get_client_columns():
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('PRAGMA table_info(Clients)')
-        return [col[1] for col in cursor.fetchall()]
+        return repositories.Clients(conn).columns()
 
 
 def generate_policy_number_v2(product_id, product_name):
     """Generate policy number using product ID for consistency"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-
-        # Get product abbreviation (you might want to store this in Products table)
-        product_abbreviations = {
-            1: 'INC',  # INCENDIE
-            2: 'AUT',  # AUTOMOBILE
-            3: 'MAL',  # MALADIE
-            4: 'VOY',  # VOYAGE
-            5: 'HAB'  # HABITATION
-        }
-
-        prefix = product_abbreviations.get(product_id, 'POL')
-        current_year = datetime.now().year
-        cursor.execute('''
-                    SELECT PolicyNumber FROM Policies 
-                    WHERE PolicyNumber LIKE ? 
-                    ORDER BY PolicyID DESC LIMIT 1
-                ''', (f'{prefix}{current_year}-%',))
+    # Get product abbreviation (you might want to store this in Products table)
+    product_abbreviations = {
+        1: 'INC',  # INCENDIE
+        2: 'AUT',  # AUTOMOBILE
+        3: 'MAL',  # MALADIE
+        4: 'VOY',  # VOYAGE
+        5: 'HAB'  # HABITATION
+    }
 
-        last_policy = cursor.fetchone()
+    prefix = product_abbreviations.get(product_id, 'POL')
+    current_year = datetime.now().year
+    # One candidate per shard when sharded, numbering stays global
+    last_policies = query_all('''
+                SELECT PolicyNumber FROM Policies 
+                WHERE PolicyNumber LIKE ? 
+                ORDER BY PolicyID DESC LIMIT 1
+            ''', (f'{prefix}{current_year}-%',))
 
-        if last_policy:
-            last_number = int(last_policy['PolicyNumber'].split('-')[1])
-            next_number = last_number + 1
-        else:
-            next_number = 1
+    if last_policies:
+        last_number = max(int(policy['PolicyNumber'].split('-')[1]) for policy in last_policies)
+        next_number = last_number + 1
+    else:
+        next_number = 1
 
-        return f'{prefix}{current_year}-{next_number}'
+    return f'{prefix}{current_year}-{next_number}'
 
 
-def get_parameter_form_data():
-    """Get all dropdown options for policy parameters form"""
+def get_parameter_form_data(type_bien_id=None):
+    """Get the dropdown options for policy parameters form, sous types only under `type_bien_id`"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -70,9 +350,6 @@ def get_parameter_form_data():
         cursor.execute('SELECT * FROM TypeBien ORDER BY TypeBienName')
         type_bien = cursor.fetchall()
 
-        cursor.execute('SELECT * FROM SousTypeBien ORDER BY SousTypeBienName')
-        sous_type_bien = cursor.fetchall()
-
         cursor.execute('SELECT * FROM CategorieBien ORDER BY CategorieBienName')
         categorie_bien = cursor.fetchall()
 
@@ -88,7 +365,8 @@ def get_parameter_form_data():
     return {
         'provinces': provinces,
         'type_bien': type_bien,
-        'sous_type_bien': sous_type_bien,
+        # The other sous types are filled in by the browser from the reference bundle
+        'sous_type_bien': get_sous_types_by_parent(type_bien_id) if type_bien_id else [],
         'categorie_bien': categorie_bien,
         'type_materiaux': type_materiaux,
         'categorie_risque': categorie_risque,
@@ -96,120 +374,314 @@ def get_parameter_form_data():
     }
 
 
+def get_reference_bundle():
+    """Get the versioned bundle of lookup trees used by the dependent dropdowns"""
+    now = time.time()
+    if _reference_bundle['bundle'] and now - _reference_bundle['built_at'] < app.config['REFERENCE_DATA_TTL']:
+        return _reference_bundle['bundle']
+
+    # Garantits that have a tarif today, per sous type, from the index used for pricing
+    tarif_garantits = get_tarif_index().garantits_in_effect(datetime.now().strftime('%Y-%m-%d'))
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT TypeBienID, TypeBienName FROM TypeBien ORDER BY TypeBienName')
+        type_bien = [dict(row) for row in cursor.fetchall()]
+
+        sous_types_by_parent = {}
+        cursor.execute('SELECT SousTypeBienID, SousTypeBienName, ParentID FROM SousTypeBien ORDER BY SousTypeBienName')
+        for row in cursor.fetchall():
+            sous_type = dict(row)
+            sous_type['TarifGarantitIDs'] = tarif_garantits.get(row['SousTypeBienID'], [])
+            sous_types_by_parent.setdefault(str(row['ParentID']), []).append(sous_type)
+
+        cursor.execute('SELECT ProvinceID, ProvinceName FROM Provinces ORDER BY ProvinceName')
+        provinces = [dict(row) for row in cursor.fetchall()]
+
+        cursor.execute('SELECT GarantitID, GarantitCode, GarantitName, IsDefault FROM Garantits ORDER BY GarantitID')
+        garantits = [dict(row) for row in cursor.fetchall()]
+
+    data = {
+        'type_bien': type_bien,
+        'sous_types_by_parent': sous_types_by_parent,
+        'provinces': provinces,
+        'garantits': garantits
+    }
+    # The version is a content hash, so it only changes when the lookups do
+    version = hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    data['version'] = version
+
+    bundle = {
+        'version': version,
+        'data': data,
+        'payload': json.dumps(data, separators=(',', ':'))
+    }
+    _reference_bundle.update(built_at=now, bundle=bundle)
+    return bundle
+
+
 def get_sous_types_by_parent(parent_id):
     """Get sub-types for a given parent type"""
+    sous_types = get_reference_bundle()['data']['sous_types_by_parent'].get(str(parent_id), [])
+    return [{key: sous_type[key] for key in ('SousTypeBienID', 'SousTypeBienName', 'ParentID')}
+            for sous_type in sous_types]
+
+
+def ensure_book_schema(agency_id=None):
+    """Create the latest-calculation pointer and the client book indexes of a database once per process"""
+    if agency_id not in _book_schema_ready:
+        with get_db_connection(agency_id) as conn:
+            client360.ensure_indexes(conn)
+            archiving.ensure_latest_pointer(conn)
+        _book_schema_ready.add(agency_id)
+
+
+def ensure_exposure_schema():
+    """Create the exposure tables in the shared database once per process"""
+    if not _exposure_ready:
+        with get_db_connection() as conn:
+            exposure.ensure_schema(conn)
+        _exposure_ready.append(True)
+
+
+def exposure_warnings(conn, policy_id, parameters):
+    """Messages for the exposure capacities an active policy exceeds with `parameters` as its parameter set.
+
+    Call it before the parameters are applied to the totals: the policy's
+    change in sum insured is added to them, not its whole value.
+    """
+    policy = repositories.Policies(conn).get(policy_id)
+    if parameters is None or policy is None or policy['Status'] != 'Active':
+        return []
+
+    sum_insured = (parameters['ValeurBienAssure'] or 0) + (parameters['ValeurEquipementsInterieur'] or 0)
+    exceeded = exposure.check_policy_change(conn, policy_id, parameters['ProvinceID'], parameters['Zone'],
+                                            sum_insured)
+    return [f'Exposure capacity exceeded for this {scope}: {format_currency(total)} insured '
+            f'against a capacity of {format_currency(capacity)}'
+            for scope, capacity, total in exceeded]
+
+
+def ensure_duplicate_schema():
+    """Create the duplicate detection tables in the shared database once per process.
+
+    The blocking keys are seeded from all clients while the index is empty, so
+    duplicate checks work before the first find-duplicates run.
+    """
+    if not _duplicates_ready:
+        with get_db_connection() as conn:
+            duplicates.ensure_schema(conn)
+            indexed = conn.execute('SELECT 1 FROM ClientMatchKeys LIMIT 1').fetchone()
+        if not indexed:
+            clients = query_all(duplicates.CLIENT_QUERY)
+            with get_db_connection() as conn:
+                duplicates.index_clients(conn, clients)
+                conn.commit()
+        _duplicates_ready.append(True)
+
+
+def find_client_duplicates(client):
+    """Existing clients that look like `client`, as (score, reasons, client row) best first"""
+    ensure_duplicate_schema()
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM SousTypeBien WHERE ParentID = ? ORDER BY SousTypeBienName', (parent_id,))
-        return cursor.fetchall()
+        ids = duplicates.candidate_ids(conn, client)
+    if not ids:
+        return []
+
+    candidates = read_all(lambda conn: repositories.Clients(conn).get_many(ids))
+    return duplicates.rank_matches(client, candidates)
 
 
-def calculate_prime(policy_id):
-    """Calculate the insurance prime for a policy using SQLite"""
+def index_client_keys(client_id, remove=False):
+    """Refresh the duplicate blocking keys of one client after it was saved or deleted"""
+    ensure_duplicate_schema()
+    client = None
+    if not remove:
+        with get_db_connection(client_shard(client_id)) as conn:
+            client = conn.execute('SELECT * FROM Clients WHERE ID = ?', (client_id,)).fetchone()
+
     with get_db_connection() as conn:
-        cursor = conn.cursor()
+        if client:
+            duplicates.index_client(conn, client)
+        else:
+            duplicates.remove_client(conn, client_id)
+        conn.commit()
 
-        # Calculate prime using SQL with detailed breakdown
-        cursor.execute('''
-            SELECT 
-                pp.ParamID,
-                pp.SousTypeBienID,
-                stb.SousTypeBienName,
-                pp.ValeurBienAssure,
-                pp.ValeurEquipementsInterieur,
-                (pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) AS ValeurAssure,
-                GROUP_CONCAT(g.GarantitCode) AS SelectedGarantits,
-                SUM(t.TarifRate) AS TotalTarifRate,
-
-                -- Prime Nette (PN)
-                SUM((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) AS PN,
-
-                -- Frais (FR) = 8% of PN
-                SUM((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 0.08 AS FR,
-
-                -- Commission de Courtage (CD) = 5.5% of (PN + FR)
-                (SUM((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 1.08) * 0.055 AS CD,
-
-                -- TVA = 18% of (PN + FR + CD)
-                (SUM((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 1.08 * 1.055) * 0.18 AS TVA,
-
-                -- Prime Totale (PT) = PN + FR + CD + TVA
-                SUM((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 1.08 * 1.055 * 1.18 AS PT,
-
-                -- Detailed breakdown for each garantit with all components
-                GROUP_CONCAT(
-                    g.GarantitCode || ':' || 
-                    t.TarifRate || ':' || 
-                    ((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) || ':' ||  -- PN
-                    ((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 0.08 || ':' ||  -- FR
-                    ((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 1.08 * 0.055 || ':' ||  -- CD
-                    ((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 1.08 * 1.055 * 0.18 || ':' ||  -- TVA
-                    ((pp.ValeurBienAssure + pp.ValeurEquipementsInterieur) * t.TarifRate / 100) * 1.08 * 1.055 * 1.18  -- PT
-                ) AS GarantitDetails
 
-            FROM PolicyParameters pp
-            JOIN PolicyGarantits pg ON pp.ParamID = pg.PolicyParamID
-            JOIN Garantits g ON pg.GarantitID = g.GarantitID
-            JOIN Tarifs t ON pp.SousTypeBienID = t.SousTypeBienID AND pg.GarantitID = t.GarantitID
-            JOIN SousTypeBien stb ON pp.SousTypeBienID = stb.SousTypeBienID
-            WHERE pp.PolicyID = ? AND pg.IsSelected = 1
-            GROUP BY pp.ParamID
-        ''', (policy_id,))
+def load_policy_documents(policy_ids=None, agency_id=None, date_from=None, date_to=None,
+                          date_field='production'):
+    """Document data of the given policies, or of those matching the agency and date filters"""
+    agencies = sharding.shard_agencies(app.config['SHARD_DIR']) if app.config['SHARDING'] else [None]
+    if policy_ids is not None and app.config['SHARDING']:
+        agencies = sorted({policy_shard(policy_id) for policy_id in policy_ids})
 
-        prime_data = cursor.fetchone()
-
-        if not prime_data:
-            return None
-
-        # Parse garantit details with all components
-        garantit_details = []
-        if prime_data['GarantitDetails']:
-            for detail in prime_data['GarantitDetails'].split(','):
-                parts = detail.split(':')
-                if len(parts) == 7:
-                    garantit_details.append({
-                        'code': parts[0],
-                        'tarif_rate': float(parts[1]),
-                        'pn': float(parts[2]),  # Prime Nette
-                        'fr': float(parts[3]),  # Frais
-                        'cd': float(parts[4]),  # Commission de Courtage
-                        'tva': float(parts[5]),  # TVA
-                        'pt': float(parts[6])  # Prime Totale
-                    })
-
-        return {
-            'param_id': prime_data['ParamID'],
-            'sous_type_bien_id': prime_data['SousTypeBienID'],
-            'sous_type_bien_name': prime_data['SousTypeBienName'],
-            'valeur_bien': prime_data['ValeurBienAssure'] or 0,
-            'valeur_equipements': prime_data['ValeurEquipementsInterieur'] or 0,
-            'valeur_assure': prime_data['ValeurAssure'] or 0,
-            'selected_garantits': prime_data['SelectedGarantits'],
-            'total_tarif_rate': prime_data['TotalTarifRate'] or 0,
-            'pn': prime_data['PN'] or 0,
-            'fr': prime_data['FR'] or 0,
-            'cd': prime_data['CD'] or 0,
-            'tva': prime_data['TVA'] or 0,
-            'pt': prime_data['PT'] or 0,
-            'garantit_details': garantit_details
-        }
+    loaded = {}
+    for agency in agencies:
+        with get_db_connection(agency) as conn:
+            ids = policy_ids
+            if ids is None:
+                ids = documents.select_policy_ids(conn, agency_id, date_from, date_to, date_field)
+            loaded.update(documents.load_documents(conn, ids))
+    return dict(sorted(loaded.items()))
 
 
-@app.route('/')
-def dashboard():
+def get_tarif_index():
+    """Get the point-in-time tarif index, rebuilt at most every REFERENCE_DATA_TTL seconds"""
+    now = time.time()
+    if _tarif_index['index'] and now - _tarif_index['built_at'] < app.config['REFERENCE_DATA_TTL']:
+        return _tarif_index['index']
+
     with get_db_connection() as conn:
-        cursor = conn.cursor()
+        index = tariffs.TarifIndex.load(conn, datetime.now().strftime('%Y-%m-%d'))
 
-        # Get total clients count
-        cursor.execute('SELECT COUNT(*) FROM Clients')
-        total_clients = cursor.fetchone()[0]
+    _tarif_index.update(built_at=now, index=index)
+    return index
 
-        # Get recent clients
-        cursor.execute('SELECT * FROM Clients ORDER BY ID DESC LIMIT 5')
-        recent_clients = cursor.fetchall()
 
-        # Get columns for system info
-        columns = get_client_columns()
+def fetch_prime_inputs(policy_ids, on_date=None):
+    """Get the selected garantits of each policy with the tarif rate in effect.
+
+    Rates are taken at `on_date` or, by default, at each policy's ProductionDate.
+    Returns PolicyID -> list of rows of the policy's first parameter set, each
+    row extended with its TarifRate; garantits without a tarif are left out.
+    """
+    index = get_tarif_index()
+    policy_ids_by_shard = {}
+    for policy_id in policy_ids:
+        policy_ids_by_shard.setdefault(policy_shard(policy_id), []).append(policy_id)
+    rows_by_policy = {}
+
+    for agency_id, shard_policy_ids in policy_ids_by_shard.items():
+        with get_db_connection(agency_id) as conn:
+            cursor = conn.cursor()
+
+            # Stay well below SQLite's host parameter limit
+            for start in range(0, len(shard_policy_ids), 500):
+                chunk = shard_policy_ids[start:start + 500]
+                cursor.execute(f'''
+                    SELECT pp.PolicyID, p.ProductionDate, pp.ParamID, pp.SousTypeBienID, stb.SousTypeBienName,
+                           pp.ValeurBienAssure, pp.ValeurEquipementsInterieur,
+                           g.GarantitID, g.GarantitCode
+                    FROM PolicyParameters pp
+                    JOIN Policies p ON pp.PolicyID = p.PolicyID
+                    JOIN PolicyGarantits pg ON pp.ParamID = pg.PolicyParamID
+                    JOIN Garantits g ON pg.GarantitID = g.GarantitID
+                    JOIN SousTypeBien stb ON pp.SousTypeBienID = stb.SousTypeBienID
+                    WHERE pp.PolicyID IN ({', '.join('?' * len(chunk))}) AND pg.IsSelected = 1
+                    ORDER BY pp.PolicyID, pp.ParamID, g.GarantitID
+                ''', chunk)
+
+                for row in cursor.fetchall():
+                    policy_rows = rows_by_policy.setdefault(row['PolicyID'], [])
+                    # Only the first parameter set of a policy is priced
+                    if policy_rows and policy_rows[0]['ParamID'] != row['ParamID']:
+                        continue
+
+                    tarif_rate = index.rate_at(row['SousTypeBienID'], row['GarantitID'],
+                                               on_date or row['ProductionDate'])
+                    if tarif_rate is not None:
+                        row = dict(row)
+                        row['TarifRate'] = tarif_rate
+                        policy_rows.append(row)
+
+    return {policy_id: rows for policy_id, rows in rows_by_policy.items() if rows}
+
+
+def calculate_prime(policy_id, on_date=None):
+    """Calculate the insurance prime for a policy in the configured arithmetic mode"""
+    return calculate_primes([policy_id], on_date).get(policy_id)
+
+
+def calculate_primes(policy_ids, on_date=None):
+    """Calculate primes for many policies in the configured arithmetic mode, keyed by PolicyID"""
+    price = price_prime_fixed if app.config['PRIME_ARITHMETIC'] == 'fixed' else price_prime_float
+    return {policy_id: price(rows) for policy_id, rows in fetch_prime_inputs(policy_ids, on_date).items()}
+
+
+def price_prime_float(rows):
+    """Price the rows fetched for one policy with floating point amounts"""
+    first = rows[0]
+    valeur_bien = first['ValeurBienAssure'] or 0
+    valeur_equipements = first['ValeurEquipementsInterieur'] or 0
+    valeur_assure = valeur_bien + valeur_equipements
+
+    garantit_details = []
+    for row in rows:
+        pn = valeur_assure * row['TarifRate'] / 100  # Prime Nette
+        garantit_details.append({
+            'garantit_id': row['GarantitID'],
+            'code': row['GarantitCode'],
+            'tarif_rate': row['TarifRate'],
+            'pn': pn,
+            'fr': pn * 0.08,  # Frais
+            'cd': pn * 1.08 * 0.055,  # Commission de Courtage
+            'tva': pn * 1.08 * 1.055 * 0.18,  # TVA
+            'pt': pn * 1.08 * 1.055 * 1.18  # Prime Totale
+        })
+
+    pn = sum(detail['pn'] for detail in garantit_details)
+
+    return {
+        'param_id': first['ParamID'],
+        'sous_type_bien_id': first['SousTypeBienID'],
+        'sous_type_bien_name': first['SousTypeBienName'],
+        'valeur_bien': valeur_bien,
+        'valeur_equipements': valeur_equipements,
+        'valeur_assure': valeur_assure,
+        'selected_garantits': ','.join(row['GarantitCode'] for row in rows),
+        'total_tarif_rate': sum(row['TarifRate'] for row in rows),
+        'pn': pn,
+        'fr': pn * 0.08,  # FR = 8% of PN
+        'cd': pn * 1.08 * 0.055,  # CD = 5.5% of (PN + FR)
+        'tva': pn * 1.08 * 1.055 * 0.18,  # TVA = 18% of (PN + FR + CD)
+        'pt': pn * 1.08 * 1.055 * 1.18,  # PT = PN + FR + CD + TVA
+        'garantit_details': garantit_details
+    }
+
+
+def price_prime_fixed(rows):
+    """Price the rows fetched for one policy in integer BIF"""
+    first = rows[0]
+    valeur_bien = premium.to_minor_units(first['ValeurBienAssure'])
+    valeur_equipements = premium.to_minor_units(first['ValeurEquipementsInterieur'])
+    valeur_assure = valeur_bien + valeur_equipements
+
+    prime = premium.compute_prime(
+        valeur_assure,
+        [(row['GarantitID'], row['GarantitCode'], row['TarifRate']) for row in rows]
+    )
+
+    return {
+        'param_id': first['ParamID'],
+        'sous_type_bien_id': first['SousTypeBienID'],
+        'sous_type_bien_name': first['SousTypeBienName'],
+        'valeur_bien': valeur_bien,
+        'valeur_equipements': valeur_equipements,
+        'valeur_assure': valeur_assure,
+        'selected_garantits': ','.join(row['GarantitCode'] for row in rows),
+        'total_tarif_rate': prime['rate_units'] / premium.RATE_SCALE,
+        'pn': prime['pn'],
+        'fr': prime['fr'],
+        'cd': prime['cd'],
+        'tva': prime['tva'],
+        'pt': prime['pt'],
+        'garantit_details': prime['garantit_details']
+    }
+
+
+@app.route('/')
+def dashboard():
+    # Get total clients count
+    total_clients = count_all(repositories.Clients, read_only=True)
+
+    # Get recent clients
+    recent_clients = query_page(lambda conn, limit, offset: repositories.Clients(conn).page(limit, offset, True),
+                                sort_key=lambda client: client['ID'], per_page=5, offset=0, reverse=True,
+                                read_only=True)
+
+    # Get columns for system info
+    columns = get_client_columns()
 
     return render_template('index.html',
                            total_clients=total_clients,
@@ -223,16 +695,13 @@ def clients():
     per_page = 10
     offset = (page - 1) * per_page
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    # Get clients for current page
+    clients = query_page(lambda conn, limit, offset: repositories.Clients(conn).page(limit, offset),
+                         sort_key=lambda client: client['ID'], per_page=per_page, offset=offset,
+                         read_only=True)
 
-        # Get clients for current page
-        cursor.execute('SELECT * FROM Clients ORDER BY ID LIMIT ? OFFSET ?', (per_page, offset))
-        clients = cursor.fetchall()
-
-        # Get total count for pagination
-        cursor.execute('SELECT COUNT(*) FROM Clients')
-        total_clients = cursor.fetchone()[0]
+    # Get total count for pagination
+    total_clients = count_all(repositories.Clients, read_only=True)
 
     total_pages = (total_clients + per_page - 1) // per_page
 
@@ -245,10 +714,8 @@ def clients():
 
 @app.route('/client/<int:id>')
 def view_client(id):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM Clients WHERE ID = ?', (id,))
-        client = cursor.fetchone()
+    with get_db_connection(client_shard(id)) as conn:
+        client = repositories.Clients(conn).get(id)
 
     if not client:
         flash('Client not found!', 'danger')
@@ -264,27 +731,30 @@ def add_client():
 
     if request.method == 'POST':
         try:
-            # Get form data and build SQL query dynamically
-            field_names = []
-            field_values = []
-            placeholders = []
-
+            # Only the filled-in fields are inserted
+            values = {}
             for column in columns:
                 if column != 'ID':  # Skip auto-increment ID
                     value = request.form.get(column)
                     if value is not None and value != '':
-                        field_names.append(column)
-                        field_values.append(value)
-                        placeholders.append('?')
-
-            if field_names:
-                sql = f"INSERT INTO Clients ({', '.join(field_names)}) VALUES ({', '.join(placeholders)})"
-
-                with get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(sql, field_values)
+                        values[column] = value
+
+            if values:
+                if not request.form.get('confirm_duplicate'):
+                    client = {column: request.form.get(column) for column in columns}
+                    client['ID'] = None
+                    matches = find_client_duplicates(client)
+                    if matches:
+                        flash('This client looks like an existing client. Check the matches below '
+                              'or confirm to create it anyway.', 'warning')
+                        return render_template('client_form.html', client=client, columns=columns,
+                                               action='add', duplicates=matches)
+
+                with get_db_connection(new_client_shard(request.form.get('BranchID'))) as conn:
+                    client_id = repositories.Clients(conn).insert(values)
                     conn.commit()
 
+                index_client_keys(client_id)
                 flash('Client added successfully!', 'success')
                 return redirect(url_for('clients'))
             else:
@@ -300,10 +770,8 @@ def add_client():
 def edit_client(id):
     columns = get_client_columns()
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM Clients WHERE ID = ?', (id,))
-        client = cursor.fetchone()
+    with get_db_connection(client_shard(id)) as conn:
+        client = repositories.Clients(conn).get(id)
 
     if not client:
         flash('Client not found!', 'danger')
@@ -311,42 +779,31 @@ def edit_client(id):
 
     if request.method == 'POST':
         try:
-            # Build update query dynamically
-            updates = []
-            values = []
-
-            for column in columns:
-                if column != 'ID':  # Don't update ID
-                    value = request.form.get(column)
-                    updates.append(f"{column} = ?")
-                    values.append(value)
-
-            values.append(id)  # For WHERE clause
+            # Every column except the ID is updated
+            values = {column: request.form.get(column) for column in columns if column != 'ID'}
 
-            sql = f"UPDATE Clients SET {', '.join(updates)} WHERE ID = ?"
-
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, values)
+            with get_db_connection(client_shard(id)) as conn:
+                repositories.Clients(conn).update(id, values)
                 conn.commit()
 
+            index_client_keys(id)
             flash('Client updated successfully!', 'success')
             return redirect(url_for('view_client', id=id))
 
         except Exception as e:
             flash(f'Error updating client: {str(e)}', 'danger')
 
-    return render_template('client_form.html', client=dict(client), columns=columns, action='edit')
+    return render_template('client_form.html', client=client, columns=columns, action='edit')
 
 
 @app.route('/client/delete/<int:id>', methods=['POST'])
 def delete_client(id):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM Clients WHERE ID = ?', (id,))
+        with get_db_connection(client_shard(id)) as conn:
+            repositories.Clients(conn).delete(id)
             conn.commit()
 
+        index_client_keys(id, remove=True)
         flash('Client deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting client: {str(e)}', 'danger')
@@ -356,14 +813,25 @@ def delete_client(id):
 
 @app.route('/api/clients')
 def api_clients():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM Clients')
-        clients = cursor.fetchall()
+    clients = read_all(lambda conn: repositories.Clients(conn).all(), read_only=True)
 
     return jsonify([dict(client) for client in clients])
 
 
+@app.route('/api/clients/duplicates')
+def duplicate_clients_api():
+    """Duplicate pairs found by the last find-duplicates run, best first"""
+    min_score = request.args.get('min_score', duplicates.DUPLICATE_THRESHOLD, type=float)
+    ensure_duplicate_schema()
+    with get_db_connection() as conn:
+        pairs = conn.execute('''
+            SELECT ClientID, DuplicateClientID, Score, Reasons, DetectedAt FROM DuplicateCandidates
+            WHERE Score >= ? ORDER BY Score DESC, ClientID
+        ''', (min_score,)).fetchall()
+
+    return jsonify([dict(pair) for pair in pairs])
+
+
 # Add this route to your existing app.py
 @app.route('/search', methods=['GET', 'POST'])
 def search_clients():
@@ -373,34 +841,16 @@ def search_clients():
     if not search_query:
         return redirect(url_for('clients'))
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-
-        # Build search query based on search type
-        if search_type == 'id':
-            try:
-                search_id = int(search_query)
-                cursor.execute('SELECT * FROM Clients WHERE ID = ?', (search_id,))
-            except ValueError:
-                cursor.execute('SELECT * FROM Clients WHERE ID = 0')  # Return empty if not numeric
-        elif search_type == 'nom':
-            cursor.execute('SELECT * FROM Clients WHERE Nom LIKE ?', (f'%{search_query}%',))
-        elif search_type == 'prenom':
-            cursor.execute('SELECT * FROM Clients WHERE Prenom LIKE ?', (f'%{search_query}%',))
-        elif search_type == 'mobphone':
-            cursor.execute('SELECT * FROM Clients WHERE MobPhone LIKE ? OR MobPhone2 LIKE ?',
-                           (f'%{search_query}%', f'%{search_query}%'))
-        else:  # search all fields
-            cursor.execute('''
-                SELECT * FROM Clients 
-                WHERE ID LIKE ? OR Nom LIKE ? OR Prenom LIKE ? OR MobPhone LIKE ? OR MobPhone2 LIKE ?
-                OR Email LIKE ? OR NIF LIKE ? OR Residence LIKE ?
-            ''', (f'%{search_query}%', f'%{search_query}%', f'%{search_query}%',
-                  f'%{search_query}%', f'%{search_query}%', f'%{search_query}%',
-                  f'%{search_query}%', f'%{search_query}%'))
+    # Search by ID, by one of the name or phone fields, or across all of them
+    try:
+        clients = read_all(lambda conn: repositories.Clients(conn).search(search_type, search_query),
+                           read_only=True)
+    except ValueError:
+        clients = []  # Return empty if not numeric
 
-        clients = cursor.fetchall()
-        total_results = len(clients)
+    if app.config['SHARDING']:
+        clients.sort(key=lambda client: client['ID'])
+    total_results = len(clients)
 
     return render_template('search_results.html',
                            clients=clients,
@@ -454,7 +904,7 @@ def get_policy_form_data():
 @app.route('/client/<int:client_id>/policies')
 def client_policies(client_id):
     """View all policies for a specific client"""
-    with get_db_connection() as conn:
+    with get_db_connection(client_shard(client_id)) as conn:
         cursor = conn.cursor()
 
         # Get client info
@@ -487,10 +937,23 @@ def client_policies(client_id):
     return render_template('client_policies.html', client=client, policies=policies)
 
 
+@app.route('/api/client/<int:client_id>/360')
+def client_360_api(client_id):
+    """The client with all policies, parameters, garantits and latest primes in one response"""
+    agency_id = client_shard(client_id)
+    ensure_book_schema(agency_id)
+    with get_db_connection(agency_id) as conn:
+        book = client360.load(conn, client_id)
+
+    if book is None:
+        return jsonify({'error': 'Client not found'}), 404
+    return jsonify(book)
+
+
 @app.route('/client/<int:client_id>/policy/add', methods=['GET', 'POST'])
 def add_policy(client_id):
     """Add a new policy for a client"""
-    with get_db_connection() as conn:
+    with get_db_connection(client_shard(client_id)) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Clients WHERE ID = ?', (client_id,))
         client = cursor.fetchone()
@@ -506,7 +969,7 @@ def add_policy(client_id):
             product_id = int(request.form['ProductID'])
 
             # Get product name for policy number generation
-            with get_db_connection() as conn:
+            with get_db_connection(client_shard(client_id)) as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT ProductName FROM Products WHERE ProductID = ?', (product_id,))
                 product = cursor.fetchone()
@@ -542,7 +1005,7 @@ def add_policy(client_id):
                 request.form['CreatedOn']
             )
 
-            with get_db_connection() as conn:
+            with get_db_connection(client_shard(client_id)) as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO Policies 
@@ -573,22 +1036,15 @@ def add_policy(client_id):
 @app.route('/policy/<int:policy_id>/edit', methods=['GET', 'POST'])
 def edit_policy(policy_id):
     """Edit an existing policy"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.*, c.Nom, c.Prenom 
-            FROM Policies p 
-            JOIN Clients c ON p.ClientID = c.ID 
-            WHERE p.PolicyID = ?
-        ''', (policy_id,))
-        policy_info = cursor.fetchone()
+    with get_db_connection(policy_shard(policy_id)) as conn:
+        policy_info = repositories.Policies(conn).with_client(policy_id)
 
     if not policy_info:
         flash('Policy not found!', 'danger')
         return redirect(url_for('clients'))
 
     form_data = get_policy_form_data()
-    with get_db_connection() as conn:
+    with get_db_connection(policy_shard(policy_id)) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM Courtiers WHERE IsActive = 1')
         courtiers = cursor.fetchall()
@@ -596,39 +1052,30 @@ def edit_policy(policy_id):
 
     if request.method == 'POST':
         try:
-            policy_data = (
-                int(request.form['ProductID']),
-                request.form.get('PolicyNumber', ''),  # Keep original number for edits
-                request.form.get('OldPolicyNumber', ''),
-                request.form.get('EndorsementNumber', ''),
-                request.form.get('OtherEndorsementNumber', '00000'),
-                int(request.form['EventTypeID']),
-                int(request.form['PolicyTypeID']),
-                int(request.form['OptionID']),
-                request.form['Description'],
-                int(request.form['CourtierID']),
-                int(request.form['TermID']),
-                request.form['ProductionDate'],
-                request.form.get('DurationMonths'),
-                request.form['ExpiryDate'],
-                request.form.get('PurchaseOrder', ''),
-                request.form.get('PurchaseOrderNumber', ''),
-                request.form.get('CreditAuthorizedBy', '---'),
-                int(request.form['AgencyID']),
-                policy_id
-            )
-
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE Policies SET 
-                    ProductID = ?, PolicyNumber = ?, OldPolicyNumber = ?, EndorsementNumber = ?,
-                    OtherEndorsementNumber = ?, EventTypeID = ?, PolicyTypeID = ?, 
-                    OptionID = ?, Description = ?, CourtierID = ?, TermID = ?, ProductionDate = ?, 
-                    DurationMonths = ?, ExpiryDate = ?, PurchaseOrder = ?, PurchaseOrderNumber = ?, 
-                    CreditAuthorizedBy = ?, AgencyID = ?, UpdatedOn = CURRENT_TIMESTAMP
-                    WHERE PolicyID = ?
-                ''', policy_data)
+            policy_data = {
+                'ProductID': int(request.form['ProductID']),
+                'PolicyNumber': request.form.get('PolicyNumber', ''),  # Keep original number for edits
+                'OldPolicyNumber': request.form.get('OldPolicyNumber', ''),
+                'EndorsementNumber': request.form.get('EndorsementNumber', ''),
+                'OtherEndorsementNumber': request.form.get('OtherEndorsementNumber', '00000'),
+                'EventTypeID': int(request.form['EventTypeID']),
+                'PolicyTypeID': int(request.form['PolicyTypeID']),
+                'OptionID': int(request.form['OptionID']),
+                'Description': request.form['Description'],
+                'CourtierID': int(request.form['CourtierID']),
+                'TermID': int(request.form['TermID']),
+                'ProductionDate': request.form['ProductionDate'],
+                'DurationMonths': request.form.get('DurationMonths'),
+                'ExpiryDate': request.form['ExpiryDate'],
+                'PurchaseOrder': request.form.get('PurchaseOrder', ''),
+                'PurchaseOrderNumber': request.form.get('PurchaseOrderNumber', ''),
+                'CreditAuthorizedBy': request.form.get('CreditAuthorizedBy', '---'),
+                'AgencyID': int(request.form['AgencyID']),
+            }
+
+            # UpdatedOn is set to CURRENT_TIMESTAMP by the repository
+            with get_db_connection(policy_shard(policy_id)) as conn:
+                repositories.Policies(conn).update(policy_id, policy_data)
                 conn.commit()
 
             flash('Policy updated successfully!', 'success')
@@ -639,7 +1086,7 @@ def edit_policy(policy_id):
 
     return render_template('policy_form.html',
                            client=policy_info,
-                           policy=dict(policy_info),
+                           policy=policy_info,
                            action='edit',
                            form_data=form_data)
 
@@ -648,13 +1095,15 @@ def edit_policy(policy_id):
 def delete_policy(policy_id):
     """Delete a policy"""
     try:
-        with get_db_connection() as conn:
+        ensure_exposure_schema()
+        with get_db_connection(policy_shard(policy_id)) as conn:
             cursor = conn.cursor()
             # Get client ID before deletion for redirect
             cursor.execute('SELECT ClientID FROM Policies WHERE PolicyID = ?', (policy_id,))
             policy = cursor.fetchone()
 
             if policy:
+                exposure.remove_policy(conn, policy_id)
                 cursor.execute('DELETE FROM Policies WHERE PolicyID = ?', (policy_id,))
                 conn.commit()
                 flash('Policy deleted successfully!', 'success')
@@ -675,26 +1124,13 @@ def all_policies():
     per_page = 10
     offset = (page - 1) * per_page
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    # Get policies with client info
+    policies = query_page(lambda conn, limit, offset: repositories.Policies(conn).page(limit, offset),
+                          sort_key=lambda policy: policy['CreatedOn'], per_page=per_page, offset=offset,
+                          reverse=True, read_only=True)
 
-        # Get policies with client info
-        cursor.execute('''
-            SELECT p.*, c.Nom, c.Prenom, c.NIF, pr.ProductName, 
-                   pt.TypeName as PolicyTypeName, a.AgencyName
-            FROM Policies p 
-            JOIN Clients c ON p.ClientID = c.ID 
-            JOIN Products pr ON p.ProductID = pr.ProductID
-            JOIN PolicyTypes pt ON p.PolicyTypeID = pt.TypeID
-            JOIN Agencies a ON p.AgencyID = a.AgencyID
-            ORDER BY p.CreatedOn DESC 
-            LIMIT ? OFFSET ?
-        ''', (per_page, offset))
-        policies = cursor.fetchall()
-
-        # Get total count
-        cursor.execute('SELECT COUNT(*) FROM Policies')
-        total_policies = cursor.fetchone()[0]
+    # Get total count
+    total_policies = count_all(repositories.Policies, read_only=True)
 
     total_pages = (total_policies + per_page - 1) // per_page
 
@@ -708,7 +1144,7 @@ def all_policies():
 @app.route('/policy/<int:policy_id>')
 def view_policy(policy_id):
     """View detailed policy information"""
-    with get_db_connection() as conn:
+    with get_db_connection(policy_shard(policy_id)) as conn:
         cursor = conn.cursor()
 
         # Get policy details with all joined information
@@ -741,7 +1177,7 @@ def view_policy(policy_id):
 @app.route('/policy/<int:policy_id>/parameters')
 def policy_parameters(policy_id):
     """View policy parameters"""
-    with get_db_connection() as conn:
+    with get_db_connection(policy_shard(policy_id)) as conn:
         cursor = conn.cursor()
 
         # Get policy info
@@ -789,7 +1225,7 @@ def policy_parameters(policy_id):
         flash('Parameters are only available for INCENDIE policies', 'warning')
         return redirect(url_for('view_policy', policy_id=policy_id))
 
-    form_data = get_parameter_form_data()
+    form_data = get_parameter_form_data(parameters['TypeBienID'] if parameters else None)
 
     return render_template('policy_parameters.html',
                            policy=policy,
@@ -801,32 +1237,13 @@ def policy_parameters(policy_id):
 @app.route('/policy/<int:policy_id>/parameters/edit', methods=['GET', 'POST'])
 def edit_policy_parameters(policy_id):
     """Edit policy parameters"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    with get_db_connection(policy_shard(policy_id)) as conn:
+        policy = repositories.Policies(conn).with_product(policy_id)
 
-        # Get policy info
-        cursor.execute('''
-            SELECT p.*, pr.ProductName 
-            FROM Policies p
-            JOIN Products pr ON p.ProductID = pr.ProductID
-            WHERE p.PolicyID = ?
-        ''', (policy_id,))
-        policy = cursor.fetchone()
-
-        # Get existing parameters if any
-        cursor.execute('SELECT * FROM PolicyParameters WHERE PolicyID = ?', (policy_id,))
-        existing_params = cursor.fetchone()
-
-        # Get Garantits selection if parameters exist
-        garantits_selection = {}
-        if existing_params:
-            cursor.execute('''
-                SELECT GarantitID, IsSelected 
-                FROM PolicyGarantits 
-                WHERE PolicyParamID = ?
-            ''', (existing_params['ParamID'],))
-            for row in cursor.fetchall():
-                garantits_selection[row['GarantitID']] = row['IsSelected']
+        # Get existing parameters and their Garantits selection if any
+        parameters = repositories.PolicyParameters(conn)
+        existing_params = parameters.for_policy(policy_id)
+        garantits_selection = parameters.garantit_selection(existing_params['ParamID']) if existing_params else {}
 
     if not policy:
         flash('Policy not found!', 'danger')
@@ -837,70 +1254,61 @@ def edit_policy_parameters(policy_id):
         flash('Parameters are only available for INCENDIE policies', 'warning')
         return redirect(url_for('view_policy', policy_id=policy_id))
 
-    form_data = get_parameter_form_data()
+    form_data = get_parameter_form_data(existing_params['TypeBienID'] if existing_params else None)
 
     if request.method == 'POST':
         try:
-            param_data = (
-                request.form.get('BienAsCode'),
-                request.form.get('CompteSouscripteur'),
-                request.form.get('Description'),
-                int(request.form['ProvinceID']) if request.form.get('ProvinceID') else None,
-                request.form.get('Ville'),
-                request.form.get('Zone'),
-                request.form.get('AdresseResidence'),
-                int(request.form['TypeBienID']) if request.form.get('TypeBienID') else None,
-                int(request.form['SousTypeBienID']) if request.form.get('SousTypeBienID') else None,
-                int(request.form['CategorieBienID']) if request.form.get('CategorieBienID') else None,
-                int(request.form['TypeMateriauxID']) if request.form.get('TypeMateriauxID') else None,
-                int(request.form['CategorieRisqueID']) if request.form.get('CategorieRisqueID') else None,
-                float(request.form.get('ValeurBienAssure', 0)),
-                float(request.form.get('ValeurEquipementsInterieur', 0)),
-                request.form.get('Observations'),
-                policy_id
-            )
-
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-
+            param_data = {
+                'BienAsCode': request.form.get('BienAsCode'),
+                'CompteSouscripteur': request.form.get('CompteSouscripteur'),
+                'Description': request.form.get('Description'),
+                'ProvinceID': int(request.form['ProvinceID']) if request.form.get('ProvinceID') else None,
+                'Ville': request.form.get('Ville'),
+                'Zone': request.form.get('Zone'),
+                'AdresseResidence': request.form.get('AdresseResidence'),
+                'TypeBienID': int(request.form['TypeBienID']) if request.form.get('TypeBienID') else None,
+                'SousTypeBienID': int(request.form['SousTypeBienID']) if request.form.get('SousTypeBienID') else None,
+                'CategorieBienID': (int(request.form['CategorieBienID'])
+                                    if request.form.get('CategorieBienID') else None),
+                'TypeMateriauxID': (int(request.form['TypeMateriauxID'])
+                                    if request.form.get('TypeMateriauxID') else None),
+                'CategorieRisqueID': (int(request.form['CategorieRisqueID'])
+                                      if request.form.get('CategorieRisqueID') else None),
+                'ValeurBienAssure': float(request.form.get('ValeurBienAssure', 0)),
+                'ValeurEquipementsInterieur': float(request.form.get('ValeurEquipementsInterieur', 0)),
+                'Observations': request.form.get('Observations'),
+            }
+            garantit_selection = {
+                garantit['GarantitID']: 1 if request.form.get(f'garantit_{garantit["GarantitID"]}') == 'on' else 0
+                for garantit in form_data['garantits']
+            }
+
+            # Created up front, a second connection would wait on this write transaction
+            ensure_exposure_schema()
+            ensure_book_schema(policy_shard(policy_id))
+            with get_db_connection(policy_shard(policy_id)) as conn:
+                # Checked against the totals before this change is applied to them
+                capacity_warnings = exposure_warnings(conn, policy_id, param_data)
+
+                parameters = repositories.PolicyParameters(conn)
+
+                # UpdatedAt is set to CURRENT_TIMESTAMP by the repository
                 if existing_params:
-                    # Update existing parameters
-                    cursor.execute('''
-                        UPDATE PolicyParameters SET 
-                        BienAsCode = ?, CompteSouscripteur = ?, Description = ?, 
-                        ProvinceID = ?, Ville = ?, Zone = ?, AdresseResidence = ?,
-                        TypeBienID = ?, SousTypeBienID = ?, CategorieBienID = ?,
-                        TypeMateriauxID = ?, CategorieRisqueID = ?,
-                        ValeurBienAssure = ?, ValeurEquipementsInterieur = ?,
-                        Observations = ?, UpdatedAt = CURRENT_TIMESTAMP
-                        WHERE PolicyID = ?
-                    ''', param_data)
                     param_id = existing_params['ParamID']
+                    parameters.update(param_id, param_data)
                 else:
-                    # Insert new parameters
-                    cursor.execute('''
-                        INSERT INTO PolicyParameters 
-                        (BienAsCode, CompteSouscripteur, Description, ProvinceID, Ville, Zone,
-                         AdresseResidence, TypeBienID, SousTypeBienID, CategorieBienID,
-                         TypeMateriauxID, CategorieRisqueID, ValeurBienAssure,
-                         ValeurEquipementsInterieur, Observations, PolicyID)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', param_data)
-                    param_id = cursor.lastrowid
-
-                # Handle Garantits selection
-                cursor.execute('DELETE FROM PolicyGarantits WHERE PolicyParamID = ?', (param_id,))
-
-                for garantit in form_data['garantits']:
-                    is_selected = 1 if request.form.get(f'garantit_{garantit["GarantitID"]}') == 'on' else 0
-                    cursor.execute('''
-                        INSERT INTO PolicyGarantits (PolicyParamID, GarantitID, IsSelected)
-                        VALUES (?, ?, ?)
-                    ''', (param_id, garantit['GarantitID'], is_selected))
+                    param_id = parameters.insert(dict(param_data, PolicyID=policy_id))
+
+                parameters.replace_garantit_selection(param_id, garantit_selection)
+
+                # Keep the province/zone accumulations in step with the insured values
+                exposure.apply_policy(conn, policy_id)
 
                 conn.commit()
 
             flash('Policy parameters saved successfully!', 'success')
+            for warning in capacity_warnings:
+                flash(warning, 'warning')
             return redirect(url_for('policy_parameters', policy_id=policy_id))
 
         except Exception as e:
@@ -908,16 +1316,38 @@ def edit_policy_parameters(policy_id):
 
     return render_template('policy_parameters_form.html',
                            policy=policy,
-                           parameters=dict(existing_params) if existing_params else None,
+                           parameters=existing_params,
                            garantits_selection=garantits_selection,
-                           form_data=form_data)
+                           form_data=form_data,
+                           reference_version=get_reference_bundle()['version'])
 
 
 @app.route('/api/sous-types/<int:parent_id>')
 def get_sous_types_api(parent_id):
     """API endpoint to get sub-types for a parent type"""
-    sous_types = get_sous_types_by_parent(parent_id)
-    return jsonify([dict(st) for st in sous_types])
+    response = jsonify(get_sous_types_by_parent(parent_id))
+    response.set_etag(get_reference_bundle()['version'])
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['REFERENCE_DATA_TTL']
+    return response.make_conditional(request)
+
+
+@app.route('/api/reference-data')
+def reference_data_api():
+    """Versioned bundle of all dropdown lookup trees"""
+    bundle = get_reference_bundle()
+    response = app.response_class(bundle['payload'], mimetype='application/json')
+    response.set_etag(bundle['version'])
+    response.cache_control.public = True
+
+    if request.args.get('v') == bundle['version']:
+        # A versioned URL never changes content, a new version gets a new URL
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = app.config['REFERENCE_DATA_TTL']
+
+    return response.make_conditional(request)
 
 @app.template_filter('format_currency')
 def format_currency(value):
@@ -931,69 +1361,420 @@ def format_currency(value):
         return '---'
 
 
+def store_prime_calculation(conn, policy_id, prime_result):
+    """Record a prime calculation with its garantit details (caller commits)"""
+    cursor = conn.cursor()
+
+    # Insert prime calculation
+    cursor.execute('''
+        INSERT INTO PrimeCalculations 
+        (PolicyID, ParamID, SousTypeBienID, ValeurBienAssure, ValeurEquipementsInterieur, 
+         ValeurAssure, TotalTarifRate, PN, FR, CD, TVA, PT)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        policy_id,
+        prime_result['param_id'],
+        prime_result['sous_type_bien_id'],
+        prime_result['valeur_bien'],
+        prime_result['valeur_equipements'],
+        prime_result['valeur_assure'],
+        prime_result['total_tarif_rate'],
+        prime_result['pn'],
+        prime_result['fr'],
+        prime_result['cd'],
+        prime_result['tva'],
+        prime_result['pt']
+    ))
+
+    prime_id = cursor.lastrowid
+
+    # Keep the latest calculation of the policy hot, older ones can be archived
+    archiving.set_latest(conn, policy_id, prime_id)
+
+    # Insert prime details for each garantit with all components
+    for detail in prime_result['garantit_details']:
+        cursor.execute('''
+            INSERT INTO PrimeDetails 
+            (PrimeID, GarantitID, TarifRate, PrimeNette, Frais, CommissionCourtage, TVA, PrimeTotale)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            prime_id,
+            detail['garantit_id'],
+            detail['tarif_rate'],
+            detail['pn'],
+            detail['fr'],
+            detail['cd'],
+            detail['tva'],
+            detail['pt']
+        ))
+
+    # The latest calculation is the premium counted in the exposure totals
+    exposure.apply_policy(conn, policy_id)
+
+
 @app.route('/policy/<int:policy_id>/calculate-prime')
 def calculate_policy_prime(policy_id):
     """Calculate and display insurance prime"""
-    prime_result = calculate_prime(policy_id)
+    # Tarifs are taken at the policy's ProductionDate unless an as_of date is given
+    as_of = request.args.get('as_of') or None
+    if as_of:
+        try:
+            as_of = datetime.strptime(as_of, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            flash('Invalid as_of date, expected YYYY-MM-DD', 'danger')
+            return redirect(url_for('policy_parameters', policy_id=policy_id))
+
+    prime_result = calculate_prime(policy_id, as_of)
 
     if not prime_result:
         flash('Cannot calculate prime: Missing policy parameters or garantits', 'warning')
         return redirect(url_for('policy_parameters', policy_id=policy_id))
 
-    # Store calculation in database
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    ensure_exposure_schema()
+    agency_id = policy_shard(policy_id)
+    ensure_book_schema(agency_id)
 
-        # Insert prime calculation
-        cursor.execute('''
-            INSERT INTO PrimeCalculations 
-            (PolicyID, ParamID, SousTypeBienID, ValeurBienAssure, ValeurEquipementsInterieur, 
-             ValeurAssure, TotalTarifRate, PN, FR, CD, TVA, PT)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            policy_id,
-            prime_result['param_id'],
-            prime_result['sous_type_bien_id'],
-            prime_result['valeur_bien'],
-            prime_result['valeur_equipements'],
-            prime_result['valeur_assure'],
-            prime_result['total_tarif_rate'],
-            prime_result['pn'],
-            prime_result['fr'],
-            prime_result['cd'],
-            prime_result['tva'],
-            prime_result['pt']
-        ))
+    # Flag the quote when the policy's zone or province is over its exposure capacity
+    with get_db_connection(agency_id) as conn:
+        capacity_warnings = exposure_warnings(conn, policy_id,
+                                              repositories.PolicyParameters(conn).for_policy(policy_id))
 
-        prime_id = cursor.lastrowid
+    # Store calculation in database; an as_of calculation is a what-if and is only displayed
+    if not as_of:
+        if not queue_write(agency_id, store_prime_calculation, policy_id, prime_result):
+            with get_db_connection(agency_id) as conn:
+                store_prime_calculation(conn, policy_id, prime_result)
+                conn.commit()
 
-        # Insert prime details for each garantit with all components
-        for detail in prime_result['garantit_details']:
-            cursor.execute('SELECT GarantitID FROM Garantits WHERE GarantitCode = ?', (detail['code'],))
-            garantit = cursor.fetchone()
+    return render_template('prime_calculation.html',
+                           policy_id=policy_id,
+                           prime_result=prime_result,
+                           as_of=as_of,
+                           capacity_warnings=capacity_warnings)
 
-            if garantit:
-                cursor.execute('''
-                    INSERT INTO PrimeDetails 
-                    (PrimeID, GarantitID, TarifRate, PrimeNette, Frais, CommissionCourtage, TVA, PrimeTotale)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    prime_id,
-                    garantit['GarantitID'],
-                    detail['tarif_rate'],
-                    detail['pn'],
-                    detail['fr'],
-                    detail['cd'],
-                    detail['tva'],
-                    detail['pt']
-                ))
 
-        conn.commit()
+@app.route('/policy/<int:policy_id>/document.pdf')
+def policy_document(policy_id):
+    """Policy certificate with the latest prime breakdown as PDF"""
+    loaded = load_policy_documents([policy_id])
+    if policy_id not in loaded:
+        flash('Policy not found!', 'danger')
+        return redirect(url_for('clients'))
 
-    return render_template('prime_calculation.html',
-                           policy_id=policy_id,
-                           prime_result=prime_result)
+    _, path, _ = next(documents.render_all(loaded, app.config['DOCUMENT_CACHE_DIR']))
+    return send_file(os.path.abspath(path), mimetype='application/pdf',
+                     download_name=documents.file_name(loaded[policy_id]))
+
+
+@app.route('/api/documents/bulk', methods=['POST'])
+def bulk_documents_api():
+    """Render the documents of an agency and/or date range, streaming progress as JSON lines.
+
+    At least one filter is required. The last line holds the URL of the zip
+    with all documents; job zips are deleted after DOCUMENT_JOB_TTL seconds.
+    """
+    date_field = request.values.get('date_field', 'production')
+    if date_field not in documents.DATE_FIELDS:
+        return jsonify({'error': f'date_field must be one of {", ".join(documents.DATE_FIELDS)}'}), 400
+
+    agency_id = request.values.get('agency_id', type=int)
+    date_from = request.values.get('date_from') or None
+    date_to = request.values.get('date_to') or None
+    if agency_id is None and date_from is None and date_to is None:
+        return jsonify({'error': 'agency_id, date_from or date_to is required'}), 400
+    for date in (date_from, date_to):
+        if date is not None:
+            try:
+                datetime.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+
+    documents.expire_jobs(app.config['DOCUMENT_JOB_DIR'], app.config['DOCUMENT_JOB_TTL'])
+    loaded = load_policy_documents(agency_id=agency_id, date_from=date_from, date_to=date_to,
+                                   date_field=date_field)
+    job_id = hashlib.sha1(f'{time.time()}-{os.getpid()}-{sorted(loaded)}'.encode()).hexdigest()[:16]
+    zip_path = os.path.join(app.config['DOCUMENT_JOB_DIR'], f'{job_id}.zip')
+    download_url = url_for('bulk_documents_download', job_id=job_id)
+    # Workers are spawned, forking the threaded server could copy locks held by other threads
+    mp_context = multiprocessing.get_context('spawn')
+
+    def progress():
+        yield json.dumps({'job_id': job_id, 'total': len(loaded)}) + '\n'
+        entries = []
+        for done, (policy_id, path, rendered) in enumerate(
+                documents.render_all(loaded, app.config['DOCUMENT_CACHE_DIR'], app.config['DOCUMENT_WORKERS'],
+                                     mp_context),
+                start=1):
+            entries.append((documents.file_name(loaded[policy_id]), path))
+            yield json.dumps({'done': done, 'total': len(loaded), 'policy_id': policy_id,
+                              'cached': not rendered}) + '\n'
+        documents.write_zip(zip_path, sorted(entries))
+        yield json.dumps({'job_id': job_id, 'done': len(entries), 'download': download_url}) + '\n'
+
+    return Response(progress(), mimetype='application/x-ndjson')
+
+
+@app.route('/documents/jobs/<job_id>.zip')
+def bulk_documents_download(job_id):
+    if not job_id.isalnum():
+        abort(404)
+    zip_path = os.path.abspath(os.path.join(app.config['DOCUMENT_JOB_DIR'], f'{job_id}.zip'))
+    if not os.path.exists(zip_path):
+        abort(404)
+    return send_file(zip_path, mimetype='application/zip', download_name=f'documents-{job_id}.zip')
+
+
+@app.route('/api/policy/<int:policy_id>/prime-history')
+def prime_history_api(policy_id):
+    """Prime calculations of a policy, newest first; ?archived=1 includes the archives"""
+    history = []
+    with get_db_connection(policy_shard(policy_id)) as conn:
+        calculations = repositories.PrimeCalculations(conn)
+        history_rows = calculations.history(policy_id)
+        details = {}
+        for row in calculations.details([row['PrimeID'] for row in history_rows]):
+            details.setdefault(row['PrimeID'], []).append(dict(row))
+
+    for row in history_rows:
+        history.append({'calculation': dict(row), 'details': details.get(row['PrimeID'], []), 'archived': False})
+
+    if request.args.get('archived') == '1':
+        for entry in archiving.archived_history(app.config['ARCHIVE_DIR'], policy_id):
+            entry['archived'] = True
+            history.append(entry)
+
+    return jsonify(history)
+
+
+@app.route('/api/exposure/<int:province_id>')
+def exposure_api(province_id):
+    """Accumulated sum insured and premium of a province, or of one zone with ?zone="""
+    zone = request.args.get('zone')
+    ensure_exposure_schema()
+    with get_db_connection() as conn:
+        sum_insured, premium_total, policy_count = exposure.zone_totals(conn, province_id, zone)
+        exceeded = exposure.check_capacity(conn, province_id, zone)
+
+    return jsonify({
+        'province_id': province_id,
+        'zone': exposure.normalize_zone(zone) if zone is not None else None,
+        'sum_insured': sum_insured,
+        'premium': premium_total,
+        'policies': policy_count,
+        'exceeded': [{'scope': scope, 'capacity': capacity, 'sum_insured': total}
+                     for scope, capacity, total in exceeded]
+    })
+
+
+@app.route('/api/reports/premiums/<dimension>')
+def premium_report_api(dimension):
+    """Premium written by product, agency, courtier, province or sous type"""
+    if dimension not in reporting.DIMENSIONS:
+        return jsonify({'error': f'Unknown report dimension: {dimension}'}), 404
+
+    report = reporting.premium_report(app.config['REPORT_SNAPSHOT_PATH'], dimension)
+    if report is None:
+        return jsonify({'error': 'No report snapshot available yet'}), 503
+
+    return jsonify(report)
+
+
+@app.cli.command('add-tarif-version')
+@click.argument('sous_type_bien_id', type=int)
+@click.argument('garantit_id', type=int)
+@click.argument('tarif_rate', type=float)
+@click.argument('effective_from')
+def add_tarif_version_command(sous_type_bien_id, garantit_id, tarif_rate, effective_from):
+    """Record a tarif rate taking effect on EFFECTIVE_FROM (YYYY-MM-DD)"""
+    effective_from = datetime.strptime(effective_from, '%Y-%m-%d').strftime('%Y-%m-%d')
+    with get_db_connection() as conn:
+        tariffs.add_version(conn, sous_type_bien_id, garantit_id, tarif_rate, effective_from,
+                            datetime.now().strftime('%Y-%m-%d'))
+
+    _tarif_index.update(built_at=0, index=None)
+    click.echo(f'Tarif {tarif_rate}% for sous type {sous_type_bien_id}, garantit {garantit_id} '
+               f'from {effective_from}')
+
+
+@app.cli.command('benchmark-primes')
+@click.option('--repeat', type=click.IntRange(min=1), default=5, help='Timed passes per arithmetic mode.')
+def benchmark_primes_command(repeat):
+    """Price every policy in bulk in both arithmetic modes, report the fastest pass and the PT gap"""
+    policy_ids = [row['PolicyID'] for row in query_all('SELECT PolicyID FROM Policies')]
+    inputs = fetch_prime_inputs(policy_ids)
+    garantit_count = sum(len(rows) for rows in inputs.values())
+
+    primes = {}
+    for mode, price in (('float', price_prime_float), ('fixed', price_prime_fixed)):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            primes[mode] = {policy_id: price(rows) for policy_id, rows in inputs.items()}
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        click.echo(f'{mode}: {len(inputs)} policies, {garantit_count} garantits priced in {best:.3f}s')
+
+    largest_gap = max((abs(prime['pt'] - primes['float'][policy_id]['pt'])
+                       for policy_id, prime in primes['fixed'].items()), default=0)
+    click.echo(f'Largest PT difference between the modes: {largest_gap:,.2f} BIF')
+
+
+@app.cli.command('rebuild-exposure')
+def rebuild_exposure_command():
+    """Recompute the exposure accumulations from all policies and report any drift"""
+    ensure_exposure_schema()
+    contributions = {}
+    if app.config['SHARDING']:
+        for agency_id in sharding.shard_agencies(app.config['SHARD_DIR']):
+            ensure_book_schema(agency_id)
+            with get_db_connection(agency_id) as conn:
+                contributions.update(exposure.collect_contributions(conn))
+    else:
+        ensure_book_schema()
+        with get_db_connection() as conn:
+            contributions.update(exposure.collect_contributions(conn))
 
+    with get_db_connection() as conn:
+        differences = exposure.rebuild(conn, contributions)
+
+    for key, stored, rebuilt in differences:
+        click.echo(f'Province {key[0]}, zone {key[1] or "-"}, risk {key[2]}: '
+                   f'stored {stored}, rebuilt {rebuilt}')
+    click.echo(f'Rebuilt exposure from {len(contributions)} active policies, '
+               f'{len(differences)} difference(s) found')
+
+
+@app.cli.command('set-exposure-capacity')
+@click.argument('province_id', type=int)
+@click.argument('max_sum_insured', type=float)
+@click.option('--zone', default='', help='Zone within the province, the whole province if omitted.')
+def set_exposure_capacity_command(province_id, max_sum_insured, zone):
+    """Set the maximum sum insured accepted in a province or zone"""
+    ensure_exposure_schema()
+    with get_db_connection() as conn:
+        conn.execute('INSERT OR REPLACE INTO ExposureCapacities (ProvinceID, Zone, MaxSumInsured) VALUES (?, ?, ?)',
+                     (province_id, exposure.normalize_zone(zone), max_sum_insured))
+        conn.commit()
+    click.echo(f'Capacity of province {province_id}{" zone " + zone if zone else ""} set to {max_sum_insured:,.0f} BIF')
+
+
+@app.cli.command('archive-primes')
+@click.option('--retention-days', type=int, default=None, help='Override ARCHIVE_RETENTION_DAYS.')
+@click.option('--enable-incremental-vacuum', is_flag=True,
+              help='Switch the databases to incremental auto-vacuum first (rewrites them once).')
+def archive_primes_command(retention_days, enable_incremental_vacuum):
+    """Archive superseded prime calculations, then vacuum and analyze (run from cron)"""
+    if retention_days is None:
+        retention_days = app.config['ARCHIVE_RETENTION_DAYS']
+    # CalculatedAt is filled by CURRENT_TIMESTAMP, which is UTC
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    agencies = sharding.shard_agencies(app.config['SHARD_DIR']) if app.config['SHARDING'] else [None]
+    for agency_id in agencies:
+        with get_db_connection(agency_id) as conn:
+            if enable_incremental_vacuum:
+                archiving.enable_incremental_vacuum(conn)
+            moved = archiving.archive_calculations(conn, app.config['ARCHIVE_DIR'], cutoff)
+            archiving.maintain(conn)
+        label = f'Agency {agency_id}' if agency_id is not None else 'Database'
+        click.echo(f'{label}: archived {moved} calculation(s) made before {cutoff}')
+
+
+@app.cli.command('find-duplicates')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, help='Processes scoring candidate pairs.')
+def find_duplicates_command(workers):
+    """Rebuild the duplicate blocking keys and list likely duplicate clients (run nightly)"""
+    ensure_duplicate_schema()
+    clients = query_all(duplicates.CLIENT_QUERY)
+    with get_db_connection() as conn:
+        compared, found, skipped = duplicates.find_duplicates(conn, clients, workers=workers)
+
+    click.echo(f'{len(clients)} clients, {compared} candidate pairs compared, {found} likely duplicates')
+    if skipped:
+        click.echo(f'{skipped} oversized block(s) of shared placeholder values skipped')
+
+
+@app.cli.command('generate-documents')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--agency-id', type=int, default=None, help='Only policies of this agency.')
+@click.option('--date-from', default=None, help='First date (YYYY-MM-DD) of the range.')
+@click.option('--date-to', default=None, help='Last date (YYYY-MM-DD) of the range.')
+@click.option('--date-field', type=click.Choice(sorted(documents.DATE_FIELDS)), default='production',
+              help='Date the range applies to.')
+@click.option('--workers', type=int, default=None, help='Override DOCUMENT_WORKERS.')
+def generate_documents_command(output, agency_id, date_from, date_to, date_field, workers):
+    """Render policy documents in bulk and bundle them into the OUTPUT zip"""
+    loaded = load_policy_documents(agency_id=agency_id, date_from=date_from, date_to=date_to,
+                                   date_field=date_field)
+    entries = []
+    rendered_count = 0
+    with click.progressbar(length=len(loaded), label='Rendering documents') as bar:
+        for policy_id, path, rendered in documents.render_all(
+                loaded, app.config['DOCUMENT_CACHE_DIR'], workers or app.config['DOCUMENT_WORKERS']):
+            entries.append((documents.file_name(loaded[policy_id]), path))
+            rendered_count += rendered
+            bar.update(1)
+
+    documents.write_zip(os.path.abspath(output), sorted(entries))
+    click.echo(f'{len(entries)} documents written to {output} '
+               f'({rendered_count} rendered, {len(entries) - rendered_count} from cache)')
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress the static files and precompile all templates"""
+    manifest = assets.build(app.static_folder)
+    _asset_manifest.clear()
+    compression = 'gzip and brotli' if assets.brotli is not None else 'gzip'
+    click.echo(f'{len(manifest)} static files fingerprinted ({compression}) into static/{assets.DIST_DIR}')
+
+    os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+    bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+    bytecode_cache.clear()
+    app.jinja_env.bytecode_cache = bytecode_cache
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    click.echo(f'{len(names)} templates precompiled into {app.config["TEMPLATE_CACHE_DIR"]}')
+
+
+@app.cli.command('shard-database')
+def shard_database_command():
+    """Split the client books of the database into per-agency shard files"""
+    moved = sharding.split_database(app.config['DATABASE'], app.config['SHARD_DIR'],
+                                    app.config['DEFAULT_AGENCY_ID'])
+    for agency_id, client_count in moved.items():
+        click.echo(f'Agency {agency_id}: {client_count} clients')
+    click.echo('The client books now live only in the shards, set SHARDING=1 to serve them.')
+
+
+@app.cli.command('snapshot-reports')
+@click.option('--force', is_flag=True, help='Snapshot even during business hours.')
+def snapshot_reports_command(force):
+    """Snapshot the premium report tables (run from cron outside business hours)"""
+    if not force and reporting.in_business_hours(app.config['REPORT_BUSINESS_HOURS']):
+        click.echo('Inside business hours, skipping snapshot (use --force to override).')
+        return
+
+    shard_databases = []
+    if app.config['SHARDING']:
+        shard_databases = [sharding.shard_path(app.config['SHARD_DIR'], agency_id)
+                           for agency_id in sharding.shard_agencies(app.config['SHARD_DIR'])]
+    snapshot = reporting.build_snapshot(app.config['DATABASE'], app.config['REPORT_SNAPSHOT_PATH'],
+                                        shard_databases)
+    click.echo(f"Snapshot of {snapshot['row_count']} policies written at {snapshot['created_at']}")
+
+
+def load_templates():
+    """Load every template from the precompiled bytecode cache, if one was built"""
+    if not os.path.isdir(app.config['TEMPLATE_CACHE_DIR']):
+        return
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+load_templates()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+"""Hot/cold storage for the prime calculation audit trail.
+
+The latest calculation of every policy stays in the live database, pointed to
+by LatestPrimeCalculations. Older calculations that have been superseded are
+moved, with their PrimeDetails, into one archive database per calendar year
+(primes_<year>.db). Each archived calculation is a single row holding its
+calculation and details as zlib-compressed JSON.
+"""
+import json
+import os
+import sqlite3
+import zlib
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS ArchivedPrimeCalculations (
+        PrimeID INTEGER PRIMARY KEY,
+        PolicyID INTEGER NOT NULL,
+        CalculatedAt TEXT,
+        Payload BLOB NOT NULL
+    )
+'''
+ARCHIVE_INDEX = 'CREATE INDEX IF NOT EXISTS idx_archived_policy ON ArchivedPrimeCalculations (PolicyID)'
+
+
+def ensure_latest_pointer(conn):
+    """Create and seed the latest-calculation pointer next to PrimeCalculations"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS main.LatestPrimeCalculations (
+            PolicyID INTEGER PRIMARY KEY,
+            PrimeID INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO main.LatestPrimeCalculations (PolicyID, PrimeID)
+        SELECT PolicyID, MAX(PrimeID) FROM main.PrimeCalculations GROUP BY PolicyID
+    ''')
+    conn.commit()
+
+
+def set_latest(conn, policy_id, prime_id):
+    """Point a policy at its newest calculation (caller commits)"""
+    conn.execute('''
+        INSERT INTO main.LatestPrimeCalculations (PolicyID, PrimeID) VALUES (?, ?)
+        ON CONFLICT(PolicyID) DO UPDATE SET PrimeID = excluded.PrimeID
+    ''', (policy_id, prime_id))
+
+
+def archive_path(archive_dir, year):
+    return os.path.join(archive_dir, f'primes_{year}.db')
+
+
+def archive_years(archive_dir):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(name[len('primes_'):-len('.db')] for name in os.listdir(archive_dir)
+                  if name.startswith('primes_') and name.endswith('.db'))
+
+
+def _connect_archive(archive_dir, year):
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = sqlite3.connect(archive_path(archive_dir, year))
+    conn.execute(ARCHIVE_SCHEMA)
+    conn.execute(ARCHIVE_INDEX)
+    return conn
+
+
+def archive_calculations(conn, archive_dir, cutoff, batch_size=1000):
+    """Move superseded calculations made before `cutoff` to the yearly archives.
+
+    Rows are written to the archive before they are deleted here, and archive
+    inserts replace by PrimeID, so an interrupted run can simply be repeated.
+    Returns the number of calculations moved.
+    """
+    ensure_latest_pointer(conn)
+    moved = 0
+
+    while True:
+        calculations = conn.execute('''
+            SELECT pc.* FROM main.PrimeCalculations pc
+            WHERE pc.PrimeID NOT IN (SELECT PrimeID FROM main.LatestPrimeCalculations)
+              AND pc.CalculatedAt < ?
+            ORDER BY pc.PrimeID
+            LIMIT ?
+        ''', (cutoff, batch_size)).fetchall()
+        if not calculations:
+            return moved
+
+        prime_ids = [row['PrimeID'] for row in calculations]
+        placeholders = ', '.join('?' * len(prime_ids))
+        details = {}
+        for row in conn.execute(f'SELECT * FROM main.PrimeDetails WHERE PrimeID IN ({placeholders})', prime_ids):
+            details.setdefault(row['PrimeID'], []).append(dict(row))
+
+        by_year = {}
+        for row in calculations:
+            payload = json.dumps({'calculation': dict(row), 'details': details.get(row['PrimeID'], [])})
+            year = (row['CalculatedAt'] or '0000')[:4]
+            by_year.setdefault(year, []).append(
+                (row['PrimeID'], row['PolicyID'], row['CalculatedAt'], zlib.compress(payload.encode('utf-8'))))
+
+        for year, rows in by_year.items():
+            archive = _connect_archive(archive_dir, year)
+            try:
+                archive.executemany('''
+                    INSERT OR REPLACE INTO ArchivedPrimeCalculations (PrimeID, PolicyID, CalculatedAt, Payload)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+                archive.commit()
+            finally:
+                archive.close()
+
+        conn.execute(f'DELETE FROM main.PrimeDetails WHERE PrimeID IN ({placeholders})', prime_ids)
+        conn.execute(f'DELETE FROM main.PrimeCalculations WHERE PrimeID IN ({placeholders})', prime_ids)
+        conn.commit()
+        moved += len(prime_ids)
+
+
+def archived_history(archive_dir, policy_id):
+    """Archived calculations of a policy, newest first, each with its details"""
+    history = []
+    for year in archive_years(archive_dir):
+        archive = sqlite3.connect(archive_path(archive_dir, year))
+        try:
+            for (payload,) in archive.execute(
+                    'SELECT Payload FROM ArchivedPrimeCalculations WHERE PolicyID = ?', (policy_id,)):
+                history.append(json.loads(zlib.decompress(payload)))
+        finally:
+            archive.close()
+
+    history.sort(key=lambda entry: entry['calculation']['PrimeID'], reverse=True)
+    return history
+
+
+def maintain(conn, vacuum_pages=2000):
+    """Return freed pages to the file system and refresh query planner statistics.
+
+    Incremental vacuum only works once the database uses auto_vacuum=INCREMENTAL
+    (see enable_incremental_vacuum); otherwise only ANALYZE runs.
+    """
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] == 2:
+        # incremental_vacuum frees one page per step; executescript steps it to the end
+        conn.executescript(f'PRAGMA main.incremental_vacuum({int(vacuum_pages)});')
+    conn.execute('ANALYZE main')
+    conn.commit()
+
+
+def enable_incremental_vacuum(conn):
+    """Switch a database to auto_vacuum=INCREMENTAL (rewrites the file once)"""
+    conn.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM main')
@@ -0,0 +1,83 @@
+"""Fingerprinted, precompressed static assets.
+
+build() copies every file of the static folder into static/dist under a name
+carrying a hash of its content (css/style.css -> dist/css/style.1a2b3c4d5e.css)
+and writes gzip, and brotli when the brotli package is installed, versions
+next to the text assets. manifest.json maps the original names to the
+fingerprinted ones. A fingerprinted file never changes, so it can be cached
+by browsers for good; a new build gives changed files new names.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always built
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map', '.html'}
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _source_files(static_dir):
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [name for name in dirs if name != DIST_DIR]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_dir).replace(os.sep, '/'), path
+
+
+def build(static_dir):
+    """Rebuild static/dist and its manifest, returns the manifest"""
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+
+    manifest = {}
+    for name, path in _source_files(static_dir):
+        with open(path, 'rb') as source:
+            content = source.read()
+
+        stem, ext = os.path.splitext(name)
+        fingerprinted = f'{DIST_DIR}/{stem}.{hashlib.sha256(content).hexdigest()[:10]}{ext}'
+        target = os.path.join(static_dir, fingerprinted)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as output:
+            output.write(content)
+
+        if ext.lower() in COMPRESSIBLE:
+            with open(target + '.gz', 'wb') as output:
+                output.write(gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as output:
+                    output.write(brotli.compress(content))
+
+        manifest[name] = fingerprinted
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir):
+    """Original name -> fingerprinted name, empty when no build has been made"""
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)) as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return {}
+
+
+def precompressed(static_dir, filename, accept_encoding):
+    """(file name, encoding) of the best precompressed variant the client accepts, or (filename, None)"""
+    accepted = {part.split(';')[0].strip() for part in (accept_encoding or '').lower().split(',')}
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.exists(os.path.join(static_dir, filename + suffix)):
+            return filename + suffix, encoding
+    return filename, None
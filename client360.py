@@ -0,0 +1,125 @@
+"""Client 360: a client with its whole book in one nested structure.
+
+The client, its policies, their parameters and selected garantits, and the
+latest prime calculation of each policy with its details are read with six
+set-based queries scoped by ClientID, however many policies the client has.
+Each query is an index search: ensure_indexes() adds the foreign key indexes
+they rely on, and the latest calculations come from LatestPrimeCalculations
+rather than a MAX(PrimeID) over PrimeCalculations.
+"""
+
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_policies_client ON Policies (ClientID)',
+    'CREATE INDEX IF NOT EXISTS idx_policy_parameters_policy ON PolicyParameters (PolicyID)',
+    'CREATE INDEX IF NOT EXISTS idx_prime_calculations_policy ON PrimeCalculations (PolicyID)',
+    'CREATE INDEX IF NOT EXISTS idx_prime_details_prime ON PrimeDetails (PrimeID)',
+)
+
+CLIENT_QUERY = 'SELECT * FROM Clients WHERE ID = ?'
+
+POLICIES_QUERY = '''
+    SELECT p.*, pr.ProductName, pt.TypeName AS PolicyTypeName,
+           po.OptionName, a.AgencyName, u.FullName AS CreatedByName,
+           et.EventName, t.TermName, c.CourtierName
+    FROM Policies p
+    LEFT JOIN Products pr ON p.ProductID = pr.ProductID
+    LEFT JOIN PolicyTypes pt ON p.PolicyTypeID = pt.TypeID
+    LEFT JOIN PolicyOptions po ON p.OptionID = po.OptionID
+    LEFT JOIN Agencies a ON p.AgencyID = a.AgencyID
+    LEFT JOIN Users u ON p.CreatedByUserID = u.UserID
+    LEFT JOIN EventTypes et ON p.EventTypeID = et.EventTypeID
+    LEFT JOIN Terms t ON p.TermID = t.TermID
+    LEFT JOIN Courtiers c ON p.CourtierID = c.CourtierID
+    WHERE p.ClientID = ?
+    ORDER BY p.CreatedOn DESC, p.PolicyID DESC
+'''
+
+CLIENT_POLICY_IDS = 'SELECT PolicyID FROM Policies WHERE ClientID = ?'
+
+PARAMETERS_QUERY = f'''
+    SELECT pp.*, pv.ProvinceName, tb.TypeBienName, stb.SousTypeBienName,
+           cb.CategorieBienName, tm.TypeMateriauxName, cr.CategorieRisqueName
+    FROM PolicyParameters pp
+    LEFT JOIN Provinces pv ON pp.ProvinceID = pv.ProvinceID
+    LEFT JOIN TypeBien tb ON pp.TypeBienID = tb.TypeBienID
+    LEFT JOIN SousTypeBien stb ON pp.SousTypeBienID = stb.SousTypeBienID
+    LEFT JOIN CategorieBien cb ON pp.CategorieBienID = cb.CategorieBienID
+    LEFT JOIN TypeMateriaux tm ON pp.TypeMateriauxID = tm.TypeMateriauxID
+    LEFT JOIN CategorieRisque cr ON pp.CategorieRisqueID = cr.CategorieRisqueID
+    WHERE pp.PolicyID IN ({CLIENT_POLICY_IDS})
+    ORDER BY pp.ParamID
+'''
+
+GARANTITS_QUERY = f'''
+    SELECT pg.PolicyParamID, g.GarantitID, g.GarantitCode, g.GarantitName
+    FROM PolicyGarantits pg
+    JOIN Garantits g ON g.GarantitID = pg.GarantitID
+    JOIN PolicyParameters pp ON pp.ParamID = pg.PolicyParamID
+    WHERE pg.IsSelected = 1 AND pp.PolicyID IN ({CLIENT_POLICY_IDS})
+    ORDER BY g.GarantitID
+'''
+
+LATEST_CALCULATION_IDS = f'''
+    SELECT PrimeID FROM LatestPrimeCalculations
+    WHERE PolicyID IN ({CLIENT_POLICY_IDS})
+'''
+
+CALCULATIONS_QUERY = f'SELECT * FROM PrimeCalculations WHERE PrimeID IN ({LATEST_CALCULATION_IDS})'
+
+DETAILS_QUERY = f'''
+    SELECT pd.*, g.GarantitCode, g.GarantitName
+    FROM PrimeDetails pd
+    LEFT JOIN Garantits g ON g.GarantitID = pd.GarantitID
+    WHERE pd.PrimeID IN ({LATEST_CALCULATION_IDS})
+    ORDER BY pd.PrimeID, pd.GarantitID
+'''
+
+
+def ensure_indexes(conn):
+    """Create the indexes the client 360 queries search by"""
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.commit()
+
+
+def load(conn, client_id):
+    """The client with its policies, parameters, garantits and latest primes, None if unknown"""
+    client = conn.execute(CLIENT_QUERY, (client_id,)).fetchone()
+    if client is None:
+        return None
+
+    policies = {}
+    for row in conn.execute(POLICIES_QUERY, (client_id,)):
+        policies[row['PolicyID']] = dict(row, parameters=[], latest_calculation=None)
+
+    parameters = {}
+    for row in conn.execute(PARAMETERS_QUERY, (client_id,)):
+        parameters[row['ParamID']] = dict(row, garantits=[])
+        policies[row['PolicyID']]['parameters'].append(parameters[row['ParamID']])
+
+    for row in conn.execute(GARANTITS_QUERY, (client_id,)):
+        parameters[row['PolicyParamID']]['garantits'].append(
+            {'GarantitID': row['GarantitID'], 'GarantitCode': row['GarantitCode'],
+             'GarantitName': row['GarantitName']})
+
+    calculations = {}
+    for row in conn.execute(CALCULATIONS_QUERY, (client_id,)):
+        calculations[row['PrimeID']] = dict(row, details=[])
+        policies[row['PolicyID']]['latest_calculation'] = calculations[row['PrimeID']]
+
+    for row in conn.execute(DETAILS_QUERY, (client_id,)):
+        calculations[row['PrimeID']]['details'].append(dict(row))
+
+    active = [policy for policy in policies.values() if policy['Status'] == 'Active']
+    return {
+        'client': dict(client),
+        'policies': list(policies.values()),
+        'summary': {
+            'policy_count': len(policies),
+            'active_policy_count': len(active),
+            'active_premium': sum(policy['latest_calculation']['PT'] for policy in active
+                                  if policy['latest_calculation']),
+            'active_sum_insured': sum(policy['latest_calculation']['ValeurAssure'] for policy in active
+                                      if policy['latest_calculation']),
+        },
+    }
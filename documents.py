@@ -0,0 +1,341 @@
+"""Policy certificate and prime breakdown documents as PDF.
+
+Documents are cached on disk under the SHA-256 of everything they show: the
+policy, its parameters and selected garantits, and its latest prime
+calculation with details. A policy whose data has not changed is never
+rendered twice; any change gives a new hash and a new file.
+
+The PDF writer is a small built-in one (standard Helvetica/Courier fonts,
+text only), so rendering needs no extra packages and runs in worker
+processes for bulk jobs.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Bump when the layout changes so cached documents are rendered again
+LAYOUT_VERSION = 1
+
+CHUNK_SIZE = 500
+DATE_FIELDS = {'production': 'ProductionDate', 'expiry': 'ExpiryDate'}
+
+POLICY_QUERY = '''
+    SELECT p.*, pr.ProductName, pt.TypeName AS PolicyTypeName, po.OptionName,
+           a.AgencyName, et.EventName, t.TermName, c.CourtierName,
+           cl.Nom, cl.Prenom, cl.NIF, cl.MobPhone
+    FROM Policies p
+    JOIN Clients cl ON p.ClientID = cl.ID
+    LEFT JOIN Products pr ON p.ProductID = pr.ProductID
+    LEFT JOIN PolicyTypes pt ON p.PolicyTypeID = pt.TypeID
+    LEFT JOIN PolicyOptions po ON p.OptionID = po.OptionID
+    LEFT JOIN Agencies a ON p.AgencyID = a.AgencyID
+    LEFT JOIN EventTypes et ON p.EventTypeID = et.EventTypeID
+    LEFT JOIN Terms t ON p.TermID = t.TermID
+    LEFT JOIN Courtiers c ON p.CourtierID = c.CourtierID
+    WHERE p.PolicyID IN ({placeholders})
+'''
+
+PARAMETERS_QUERY = '''
+    SELECT pp.*, pv.ProvinceName, stb.SousTypeBienName, cr.CategorieRisqueName
+    FROM PolicyParameters pp
+    LEFT JOIN Provinces pv ON pp.ProvinceID = pv.ProvinceID
+    LEFT JOIN SousTypeBien stb ON pp.SousTypeBienID = stb.SousTypeBienID
+    LEFT JOIN CategorieRisque cr ON pp.CategorieRisqueID = cr.CategorieRisqueID
+    WHERE pp.ParamID IN (
+        SELECT MIN(ParamID) FROM PolicyParameters WHERE PolicyID IN ({placeholders}) GROUP BY PolicyID
+    )
+'''
+
+GARANTITS_QUERY = '''
+    SELECT pg.PolicyParamID, g.GarantitCode
+    FROM PolicyGarantits pg
+    JOIN Garantits g ON g.GarantitID = pg.GarantitID
+    WHERE pg.IsSelected = 1 AND pg.PolicyParamID IN ({placeholders})
+    ORDER BY g.GarantitID
+'''
+
+CALCULATION_QUERY = '''
+    SELECT * FROM PrimeCalculations
+    WHERE PrimeID IN (
+        SELECT MAX(PrimeID) FROM PrimeCalculations WHERE PolicyID IN ({placeholders}) GROUP BY PolicyID
+    )
+'''
+
+DETAILS_QUERY = '''
+    SELECT pd.*, g.GarantitCode
+    FROM PrimeDetails pd
+    LEFT JOIN Garantits g ON g.GarantitID = pd.GarantitID
+    WHERE pd.PrimeID IN ({placeholders})
+    ORDER BY pd.PrimeID, pd.GarantitID
+'''
+
+
+def _query(conn, sql, ids):
+    return conn.execute(sql.format(placeholders=', '.join('?' * len(ids))), list(ids)).fetchall()
+
+
+def select_policy_ids(conn, agency_id=None, date_from=None, date_to=None, date_field='production'):
+    """IDs of the policies of an agency and/or with a production or expiry date in a range"""
+    column = DATE_FIELDS[date_field]
+    sql = 'SELECT PolicyID FROM Policies WHERE 1 = 1'
+    params = []
+    if agency_id is not None:
+        sql += ' AND AgencyID = ?'
+        params.append(agency_id)
+    if date_from:
+        sql += f' AND {column} >= ?'
+        params.append(date_from)
+    if date_to:
+        sql += f' AND {column} <= ?'
+        params.append(date_to)
+    return [row[0] for row in conn.execute(sql + ' ORDER BY PolicyID', params)]
+
+
+def load_documents(conn, policy_ids):
+    """Everything the documents of `policy_ids` show, as plain dicts keyed by PolicyID"""
+    documents = {}
+    policy_ids = list(policy_ids)
+    for start in range(0, len(policy_ids), CHUNK_SIZE):
+        ids = policy_ids[start:start + CHUNK_SIZE]
+
+        for row in _query(conn, POLICY_QUERY, ids):
+            documents[row['PolicyID']] = {'policy': dict(row), 'parameters': None,
+                                          'garantits': [], 'calculation': None, 'details': []}
+
+        parameters = {row['ParamID']: dict(row) for row in _query(conn, PARAMETERS_QUERY, ids)}
+        for row in parameters.values():
+            documents[row['PolicyID']]['parameters'] = row
+        if parameters:
+            for row in _query(conn, GARANTITS_QUERY, list(parameters)):
+                documents[parameters[row['PolicyParamID']]['PolicyID']]['garantits'].append(row['GarantitCode'])
+
+        calculations = {row['PrimeID']: dict(row) for row in _query(conn, CALCULATION_QUERY, ids)}
+        for row in calculations.values():
+            documents[row['PolicyID']]['calculation'] = row
+        if calculations:
+            for row in _query(conn, DETAILS_QUERY, list(calculations)):
+                documents[calculations[row['PrimeID']]['PolicyID']]['details'].append(dict(row))
+
+    return documents
+
+
+def content_hash(document):
+    payload = json.dumps([LAYOUT_VERSION, document], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cache_path(cache_dir, document_hash):
+    return os.path.join(cache_dir, document_hash[:2], f'{document_hash}.pdf')
+
+
+def file_name(document):
+    number = re.sub(r'[^A-Za-z0-9._-]+', '_', str(document['policy']['PolicyNumber']))
+    return f"{number}-{document['policy']['PolicyID']}.pdf"
+
+
+# Rendering
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Courier'}
+
+
+def _money(value):
+    if value is None:
+        return '---'
+    return f'{float(value):,.0f} BIF'
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+def document_lines(document):
+    """(font, size, text) lines of a policy certificate and its prime breakdown"""
+    policy = document['policy']
+    lines = [
+        ('F2', 16, 'BICOR ASSURANCES - Policy Certificate'),
+        ('F1', 10, ''),
+        ('F2', 12, f"Policy {_text(policy['PolicyNumber'])}"),
+        ('F1', 10, f"Product: {_text(policy['ProductName'])}    Type: {_text(policy['PolicyTypeName'])}"
+                   f"    Option: {_text(policy['OptionName'])}"),
+        ('F1', 10, f"Client: {_text(policy['Nom'])} {_text(policy['Prenom'])} (ID {policy['ClientID']}, "
+                   f"NIF {_text(policy['NIF'])})"),
+        ('F1', 10, f"Agency: {_text(policy['AgencyName'])}    Courtier: {_text(policy['CourtierName'])}"),
+        ('F1', 10, f"Event: {_text(policy['EventName'])}    Term: {_text(policy['TermName'])}"),
+        ('F1', 10, f"Period: {_text(policy['ProductionDate'])} to {_text(policy['ExpiryDate'])}"
+                   f"    Status: {_text(policy['Status'])}"),
+    ]
+
+    parameters = document['parameters']
+    if parameters:
+        lines += [
+            ('F1', 10, ''),
+            ('F2', 12, 'Insured Property'),
+            ('F1', 10, f"Sous type bien: {_text(parameters['SousTypeBienName'])}    "
+                       f"Risk: {_text(parameters['CategorieRisqueName'])}"),
+            ('F1', 10, f"Location: {_text(parameters['AdresseResidence'])}, {_text(parameters['Ville'])}, "
+                       f"zone {_text(parameters['Zone'])}, {_text(parameters['ProvinceName'])}"),
+            ('F1', 10, f"Valeur bien assure: {_money(parameters['ValeurBienAssure'])}    "
+                       f"Valeur equipements: {_money(parameters['ValeurEquipementsInterieur'])}"),
+            ('F1', 10, f"Garantits: {', '.join(document['garantits']) or '---'}"),
+        ]
+
+    calculation = document['calculation']
+    if calculation:
+        lines += [
+            ('F1', 10, ''),
+            ('F2', 12, 'Prime Breakdown'),
+            ('F1', 10, f"Calculated at {_text(calculation['CalculatedAt'])}    "
+                       f"Valeur assuree: {_money(calculation['ValeurAssure'])}    "
+                       f"Total tarif rate: {calculation['TotalTarifRate']}%"),
+            ('F1', 10, ''),
+            ('F3', 9, f"{'Garantit':<10}{'Rate %':>8}{'PN':>14}{'FR':>12}{'CD':>12}{'TVA':>12}{'PT':>14}"),
+        ]
+        for detail in document['details']:
+            lines.append(('F3', 9, f"{_text(detail['GarantitCode']):<10}{detail['TarifRate']:>8}"
+                                   f"{detail['PrimeNette']:>14,.0f}{detail['Frais']:>12,.0f}"
+                                   f"{detail['CommissionCourtage']:>12,.0f}{detail['TVA']:>12,.0f}"
+                                   f"{detail['PrimeTotale']:>14,.0f}"))
+        lines.append(('F3', 9, f"{'Total':<10}{calculation['TotalTarifRate']:>8}"
+                               f"{calculation['PN']:>14,.0f}{calculation['FR']:>12,.0f}"
+                               f"{calculation['CD']:>12,.0f}{calculation['TVA']:>12,.0f}"
+                               f"{calculation['PT']:>14,.0f}"))
+        lines += [
+            ('F1', 10, ''),
+            ('F2', 12, f"Prime Totale: {_money(calculation['PT'])}"),
+        ]
+    else:
+        lines += [('F1', 10, ''), ('F1', 10, 'No prime has been calculated for this policy yet.')]
+
+    return lines
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(lines):
+    """Minimal PDF 1.4 with one text line per entry, flowing onto new pages"""
+    pages = [[]]
+    y = PAGE_HEIGHT - MARGIN
+    for font, size, text in lines:
+        leading = size * 1.5
+        if y - leading < MARGIN:
+            pages.append([])
+            y = PAGE_HEIGHT - MARGIN
+        y -= leading
+        pages[-1].append(f'BT /{font} {size} Tf {MARGIN} {y:.1f} Td ({_escape(text)}) Tj ET')
+
+    objects = []  # index 0 is object 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font_refs = {name: add(f'<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>'
+                           .encode('latin-1'))
+                 for name, base in FONTS.items()}
+    resources = ' '.join(f'/{name} {ref} 0 R' for name, ref in font_refs.items())
+
+    page_refs = []
+    for page in pages:
+        stream = zlib.compress('\n'.join(page).encode('latin-1', errors='replace'))
+        content = add(f'<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n'.encode('latin-1')
+                      + stream + b'\nendstream')
+        page_refs.append(add(f'<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                             f'/Resources << /Font << {resources} >> >> /Contents {content} 0 R >>'
+                             .encode('latin-1')))
+
+    objects[catalog - 1] = f'<< /Type /Catalog /Pages {page_tree} 0 R >>'.encode('latin-1')
+    objects[page_tree - 1] = (f"<< /Type /Pages /Kids [{' '.join(f'{ref} 0 R' for ref in page_refs)}] "
+                              f'/Count {len(page_refs)} >>').encode('latin-1')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f'{number} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n'
+
+    xref_offset = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    for offset in offsets:
+        output += f'{offset:010d} 00000 n \n'.encode('latin-1')
+    output += (f'trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\n'
+               f'startxref\n{xref_offset}\n%%EOF\n').encode('latin-1')
+    return bytes(output)
+
+
+def render_to_file(document, path):
+    """Render a document and write it atomically to `path`"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as pdf:
+        pdf.write(build_pdf(document_lines(document)))
+    os.replace(tmp_path, path)
+    return path
+
+
+def render_all(documents, cache_dir, workers=1, mp_context=None):
+    """Make sure every document is in the cache, yielding (PolicyID, path, rendered) as they are ready.
+
+    Cached documents are yielded first; the others are rendered in a pool of
+    `workers` processes when more than one is given, started with
+    `mp_context` when one is given.
+    """
+    pending = []
+    for policy_id, document in documents.items():
+        path = cache_path(cache_dir, content_hash(document))
+        if os.path.exists(path):
+            yield policy_id, path, False
+        else:
+            pending.append((policy_id, document, path))
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+            futures = {pool.submit(render_to_file, document, path): policy_id
+                       for policy_id, document, path in pending}
+            for future in as_completed(futures):
+                yield futures[future], future.result(), True
+    else:
+        for policy_id, document, path in pending:
+            yield policy_id, render_to_file(document, path), True
+
+
+def write_zip(zip_path, entries):
+    """Bundle (name, path) PDFs into one zip, written atomically"""
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    tmp_path = f'{zip_path}.tmp'
+    # PDF content streams are already deflated
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path in entries:
+            archive.write(path, name)
+    os.replace(tmp_path, zip_path)
+    return zip_path
+
+
+def expire_jobs(job_dir, max_age):
+    """Delete job zips, and temporary files of interrupted jobs, older than `max_age` seconds"""
+    if not os.path.isdir(job_dir):
+        return 0
+    cutoff = time.time() - max_age
+    expired = 0
+    for name in os.listdir(job_dir):
+        if not name.endswith(('.zip', '.zip.tmp')):
+            continue
+        path = os.path.join(job_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                expired += 1
+        except FileNotFoundError:
+            # Expired by another request at the same time
+            continue
+    return expired
@@ -0,0 +1,250 @@
+"""Duplicate client detection with blocking keys.
+
+Every client gets a few blocking keys: its normalized NIF, its normalized
+phone numbers and a phonetic key of Nom/Prenom (in either order). Only
+clients that share a key are compared, so the work grows with the size of
+the blocks instead of with the square of the client book. The keys are kept
+in ClientMatchKeys, which makes the check of a new client a few index
+lookups.
+
+Candidate pairs are scored on NIF, phone and name similarity; a shared NIF is
+enough on its own. Pairs at or above the threshold are stored in
+DuplicateCandidates by the nightly batch.
+"""
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS ClientMatchKeys (
+        ClientID INTEGER NOT NULL,
+        KeyType TEXT NOT NULL,
+        KeyValue TEXT NOT NULL,
+        PRIMARY KEY (ClientID, KeyType, KeyValue)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_client_match_keys ON ClientMatchKeys (KeyType, KeyValue)',
+    '''
+    CREATE TABLE IF NOT EXISTS DuplicateCandidates (
+        ClientID INTEGER NOT NULL,
+        DuplicateClientID INTEGER NOT NULL,
+        Score REAL NOT NULL,
+        Reasons TEXT NOT NULL,
+        DetectedAt TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (ClientID, DuplicateClientID)
+    )
+    '''
+)
+
+CLIENT_QUERY = 'SELECT ID, NIF, Nom, Prenom, MobPhone, MobPhone2 FROM Clients'
+
+# Score of each matching signal, a pair is a duplicate from DUPLICATE_THRESHOLD.
+# A NIF identifies a client, so an exact NIF match reaches the threshold on its own;
+# phone and name only reach it together.
+DUPLICATE_THRESHOLD = 0.6
+NIF_WEIGHT = DUPLICATE_THRESHOLD
+PHONE_WEIGHT = 0.3
+NAME_WEIGHT = 0.35
+
+# Blocks larger than this are placeholder values shared by many clients, not identities
+MAX_BLOCK_SIZE = 200
+
+PHONETIC_REPLACEMENTS = (('PH', 'F'), ('CK', 'K'), ('QU', 'K'), ('SH', 'S'), ('CH', 'S'),
+                         ('C', 'K'), ('Q', 'K'), ('Z', 'S'), ('W', 'V'), ('Y', 'I'), ('H', ''))
+
+
+def ensure_schema(conn):
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+
+
+def _ascii_upper(value):
+    value = unicodedata.normalize('NFKD', str(value or ''))
+    return ''.join(char for char in value if not unicodedata.combining(char)).upper()
+
+
+def normalize_nif(nif):
+    """Alphanumeric upper-case NIF, '' for blanks and placeholders such as '0'"""
+    nif = ''.join(char for char in _ascii_upper(nif) if char.isalnum())
+    return nif if len(nif) >= 4 and nif.strip('0') else ''
+
+
+def normalize_phone(phone):
+    """Eight-digit local number, without the 257 country code, '' when unusable"""
+    digits = ''.join(char for char in str(phone or '') if char.isdigit())
+    if len(digits) > 8 and digits.startswith('257'):
+        digits = digits[3:]
+    return digits if len(digits) == 8 and digits.strip('0') else ''
+
+
+def normalize_name(name):
+    return ' '.join(''.join(char if char.isalpha() else ' ' for char in _ascii_upper(name)).split())
+
+
+def phonetic_key(name):
+    """Consonant skeleton of a name, so that spelling variants share a key"""
+    name = normalize_name(name).replace(' ', '')
+    if not name:
+        return ''
+    for old, new in PHONETIC_REPLACEMENTS:
+        name = name.replace(old, new)
+    if not name:
+        return ''
+
+    key = name[0]
+    for char in name[1:]:
+        if char not in 'AEIOU' and char != key[-1]:
+            key += char
+    return key
+
+
+def profile(client):
+    """Normalized (ID, NIF, phones, Nom, Prenom) of a client row or form"""
+    phones = frozenset(phone for phone in (normalize_phone(client['MobPhone']),
+                                           normalize_phone(client['MobPhone2'])) if phone)
+    return (client['ID'], normalize_nif(client['NIF']), phones,
+            normalize_name(client['Nom']), normalize_name(client['Prenom']))
+
+
+def blocking_keys(client_profile):
+    _, nif, phones, nom, prenom = client_profile
+    keys = []
+    if nif:
+        keys.append(('nif', nif))
+    keys.extend(('phone', phone) for phone in sorted(phones))
+    names = sorted(key for key in (phonetic_key(nom), phonetic_key(prenom)) if key)
+    if names:
+        keys.append(('name', '|'.join(names)))
+    return keys
+
+
+def score(a, b):
+    """Similarity of two profiles between 0 and 1, and the signals that matched"""
+    total = 0
+    reasons = []
+    if a[1] and a[1] == b[1]:
+        total += NIF_WEIGHT
+        reasons.append('nif')
+    if a[2] & b[2]:
+        total += PHONE_WEIGHT
+        reasons.append('phone')
+
+    name_a = f'{a[3]} {a[4]}'
+    similarity = max(SequenceMatcher(None, name_a, f'{b[3]} {b[4]}').ratio(),
+                     SequenceMatcher(None, name_a, f'{b[4]} {b[3]}').ratio())
+    if similarity >= 0.8:
+        total += NAME_WEIGHT * similarity
+        reasons.append('name')
+    return min(total, 1.0), reasons
+
+
+def _score_chunk(pairs, threshold=DUPLICATE_THRESHOLD):
+    matches = []
+    for a, b in pairs:
+        pair_score, reasons = score(a, b)
+        if pair_score >= threshold:
+            matches.append((a[0], b[0], round(pair_score, 3), ','.join(reasons)))
+    return matches
+
+
+def index_client(conn, client):
+    """Replace the blocking keys of one client (caller commits)"""
+    client_profile = profile(client)
+    conn.execute('DELETE FROM ClientMatchKeys WHERE ClientID = ?', (client_profile[0],))
+    conn.executemany('INSERT OR IGNORE INTO ClientMatchKeys (ClientID, KeyType, KeyValue) VALUES (?, ?, ?)',
+                     [(client_profile[0],) + key for key in blocking_keys(client_profile)])
+
+
+def index_clients(conn, clients):
+    """Add the blocking keys of many clients, e.g. to seed an empty index (caller commits)"""
+    rows = []
+    for client in clients:
+        client_profile = profile(client)
+        rows.extend((client_profile[0],) + key for key in blocking_keys(client_profile))
+    conn.executemany('INSERT OR IGNORE INTO ClientMatchKeys (ClientID, KeyType, KeyValue) VALUES (?, ?, ?)', rows)
+
+
+def remove_client(conn, client_id):
+    """Drop a deleted client from the keys and candidates (caller commits)"""
+    conn.execute('DELETE FROM ClientMatchKeys WHERE ClientID = ?', (client_id,))
+    conn.execute('DELETE FROM DuplicateCandidates WHERE ClientID = ? OR DuplicateClientID = ?',
+                 (client_id, client_id))
+
+
+def candidate_ids(conn, client):
+    """IDs of the indexed clients sharing a blocking key with `client`"""
+    client_profile = profile(client)
+    ids = set()
+    for key_type, key_value in blocking_keys(client_profile):
+        ids.update(row[0] for row in conn.execute(
+            'SELECT ClientID FROM ClientMatchKeys WHERE KeyType = ? AND KeyValue = ? LIMIT ?',
+            (key_type, key_value, MAX_BLOCK_SIZE)))
+    ids.discard(client_profile[0])
+    return ids
+
+
+def rank_matches(client, candidates, threshold=DUPLICATE_THRESHOLD):
+    """Score candidate client rows against `client`, best match first.
+
+    Returns (score, reasons, candidate row) for the candidates at or above
+    the threshold.
+    """
+    client_profile = profile(client)
+    matches = []
+    for candidate in candidates:
+        pair_score, reasons = score(client_profile, profile(candidate))
+        if pair_score >= threshold:
+            matches.append((round(pair_score, 3), reasons, candidate))
+    matches.sort(key=lambda match: match[0], reverse=True)
+    return matches
+
+
+def find_duplicates(conn, clients, workers=1, chunk_size=20000, threshold=DUPLICATE_THRESHOLD):
+    """Rebuild the blocking keys from `clients` and store the duplicate pairs found.
+
+    Pairs are scored in a pool of `workers` processes when more than one is
+    given. Returns (pairs compared, duplicates found, oversized blocks skipped).
+    """
+    profiles = {}
+    blocks = {}
+    for client in clients:
+        client_profile = profile(client)
+        profiles[client_profile[0]] = client_profile
+        for key in blocking_keys(client_profile):
+            blocks.setdefault(key, []).append(client_profile[0])
+
+    pairs = set()
+    skipped = 0
+    for ids in blocks.values():
+        if len(ids) > MAX_BLOCK_SIZE:
+            skipped += 1
+            continue
+        ids.sort()
+        for position, client_id in enumerate(ids):
+            for other_id in ids[position + 1:]:
+                pairs.add((client_id, other_id))
+
+    pairs = sorted(pairs)
+    chunks = [[(profiles[a], profiles[b]) for a, b in pairs[start:start + chunk_size]]
+              for start in range(0, len(pairs), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_score_chunk, chunks, [threshold] * len(chunks)))
+    else:
+        results = [_score_chunk(chunk, threshold) for chunk in chunks]
+    matches = [match for result in results for match in result]
+
+    conn.execute('DELETE FROM ClientMatchKeys')
+    conn.executemany('INSERT OR IGNORE INTO ClientMatchKeys (ClientID, KeyType, KeyValue) VALUES (?, ?, ?)',
+                     ((client_id, key_type, key_value)
+                      for (key_type, key_value), ids in blocks.items() for client_id in ids))
+    conn.execute('DELETE FROM DuplicateCandidates')
+    conn.executemany('''
+        INSERT INTO DuplicateCandidates (ClientID, DuplicateClientID, Score, Reasons)
+        VALUES (?, ?, ?, ?)
+    ''', matches)
+    conn.commit()
+
+    return len(pairs), len(matches), skipped
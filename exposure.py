@@ -0,0 +1,237 @@
+"""Sum insured and premium accumulation by province, zone and risk category.
+
+ExposureContributions keeps what each active policy currently adds to the
+totals, so a change to a policy applies the difference to
+ExposureAccumulations instead of re-scanning every policy. Province-wide
+and zone capacities are set in ExposureCapacities; a capacity row with an
+empty Zone covers the whole province.
+
+Missing province or risk category IDs are accumulated under 0 and zones are
+compared trimmed and case-insensitively.
+
+The contribution query reads the premium through LatestPrimeCalculations and
+finds parameter sets by PolicyID, so callers create the pointer and the
+PolicyParameters index first (see client360.INDEXES).
+"""
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS ExposureAccumulations (
+        ProvinceID INTEGER NOT NULL,
+        Zone TEXT NOT NULL,
+        CategorieRisqueID INTEGER NOT NULL,
+        SumInsured REAL NOT NULL DEFAULT 0,
+        Premium REAL NOT NULL DEFAULT 0,
+        PolicyCount INTEGER NOT NULL DEFAULT 0,
+        UpdatedAt TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (ProvinceID, Zone, CategorieRisqueID)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS ExposureContributions (
+        PolicyID INTEGER PRIMARY KEY,
+        ProvinceID INTEGER NOT NULL,
+        Zone TEXT NOT NULL,
+        CategorieRisqueID INTEGER NOT NULL,
+        SumInsured REAL NOT NULL,
+        Premium REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS ExposureCapacities (
+        ProvinceID INTEGER NOT NULL,
+        Zone TEXT NOT NULL DEFAULT '',
+        MaxSumInsured REAL NOT NULL,
+        PRIMARY KEY (ProvinceID, Zone)
+    )
+    '''
+)
+
+# Current contribution of policies: first parameter set and latest prime calculation
+CONTRIBUTION_QUERY = '''
+    SELECT p.PolicyID, p.Status,
+           COALESCE(pp.ProvinceID, 0) AS ProvinceID,
+           UPPER(TRIM(COALESCE(pp.Zone, ''))) AS Zone,
+           COALESCE(pp.CategorieRisqueID, 0) AS CategorieRisqueID,
+           COALESCE(pp.ValeurBienAssure, 0) + COALESCE(pp.ValeurEquipementsInterieur, 0) AS SumInsured,
+           COALESCE(pc.PT, 0) AS Premium
+    FROM Policies p
+    JOIN PolicyParameters pp ON pp.ParamID = (
+        SELECT MIN(ParamID) FROM PolicyParameters WHERE PolicyID = p.PolicyID
+    )
+    LEFT JOIN LatestPrimeCalculations latest ON latest.PolicyID = p.PolicyID
+    LEFT JOIN PrimeCalculations pc ON pc.PrimeID = latest.PrimeID
+'''
+
+
+def ensure_schema(conn):
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+
+
+def normalize_zone(zone):
+    return (zone or '').strip().upper()
+
+
+def _contribution(row):
+    if row is None or row['Status'] != 'Active':
+        return None
+    return (row['ProvinceID'], row['Zone'], row['CategorieRisqueID'], row['SumInsured'], row['Premium'])
+
+
+def _add(conn, key, sum_insured, premium, policy_count):
+    conn.execute('''
+        INSERT INTO ExposureAccumulations
+        (ProvinceID, Zone, CategorieRisqueID, SumInsured, Premium, PolicyCount)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ProvinceID, Zone, CategorieRisqueID) DO UPDATE SET
+            SumInsured = SumInsured + excluded.SumInsured,
+            Premium = Premium + excluded.Premium,
+            PolicyCount = PolicyCount + excluded.PolicyCount,
+            UpdatedAt = CURRENT_TIMESTAMP
+    ''', key + (sum_insured, premium, policy_count))
+
+
+def apply_policy(conn, policy_id):
+    """Bring the totals in line with the current state of one policy (caller commits)"""
+    row = conn.execute(CONTRIBUTION_QUERY + ' WHERE p.PolicyID = ?', (policy_id,)).fetchone()
+    new = _contribution(row)
+
+    old = conn.execute('''
+        SELECT ProvinceID, Zone, CategorieRisqueID, SumInsured, Premium
+        FROM ExposureContributions WHERE PolicyID = ?
+    ''', (policy_id,)).fetchone()
+    old = tuple(old) if old else None
+
+    if old == new:
+        return
+
+    if old:
+        _add(conn, old[:3], -old[3], -old[4], -1)
+        conn.execute('DELETE FROM ExposureContributions WHERE PolicyID = ?', (policy_id,))
+    if new:
+        _add(conn, new[:3], new[3], new[4], 1)
+        conn.execute('''
+            INSERT INTO ExposureContributions
+            (PolicyID, ProvinceID, Zone, CategorieRisqueID, SumInsured, Premium)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (policy_id,) + new)
+
+
+def remove_policy(conn, policy_id):
+    """Take a deleted policy out of the totals (caller commits)"""
+    old = conn.execute('''
+        SELECT ProvinceID, Zone, CategorieRisqueID, SumInsured, Premium
+        FROM ExposureContributions WHERE PolicyID = ?
+    ''', (policy_id,)).fetchone()
+    if old:
+        _add(conn, tuple(old)[:3], -old[3], -old[4], -1)
+        conn.execute('DELETE FROM ExposureContributions WHERE PolicyID = ?', (policy_id,))
+
+
+def collect_contributions(conn):
+    """Compute the contribution of every active policy reachable from `conn`"""
+    contributions = {}
+    for row in conn.execute(CONTRIBUTION_QUERY):
+        contribution = _contribution(row)
+        if contribution:
+            contributions[row['PolicyID']] = contribution
+    return contributions
+
+
+def rebuild(conn, contributions):
+    """Replace the totals with ones recomputed from `contributions`.
+
+    Returns the (key, stored, rebuilt) differences found, where stored and
+    rebuilt are (SumInsured, Premium, PolicyCount); an empty list means the
+    incremental totals were correct.
+    """
+    rebuilt = {}
+    for province_id, zone, categorie_id, sum_insured, premium in contributions.values():
+        totals = rebuilt.setdefault((province_id, zone, categorie_id), [0, 0, 0])
+        totals[0] += sum_insured
+        totals[1] += premium
+        totals[2] += 1
+
+    stored = {}
+    for row in conn.execute('SELECT * FROM ExposureAccumulations'):
+        stored[(row['ProvinceID'], row['Zone'], row['CategorieRisqueID'])] = (
+            row['SumInsured'], row['Premium'], row['PolicyCount'])
+
+    differences = []
+    for key in sorted(set(stored) | set(rebuilt), key=str):
+        before = stored.get(key, (0, 0, 0))
+        after = tuple(rebuilt.get(key, (0, 0, 0)))
+        if before[2] != after[2] or abs(before[0] - after[0]) > 0.5 or abs(before[1] - after[1]) > 0.5:
+            differences.append((key, before, after))
+
+    conn.execute('DELETE FROM ExposureAccumulations')
+    conn.execute('DELETE FROM ExposureContributions')
+    conn.executemany('''
+        INSERT INTO ExposureAccumulations
+        (ProvinceID, Zone, CategorieRisqueID, SumInsured, Premium, PolicyCount)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [key + tuple(totals) for key, totals in rebuilt.items()])
+    conn.executemany('''
+        INSERT INTO ExposureContributions
+        (PolicyID, ProvinceID, Zone, CategorieRisqueID, SumInsured, Premium)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(policy_id,) + contribution for policy_id, contribution in contributions.items()])
+    conn.commit()
+
+    return differences
+
+
+def zone_totals(conn, province_id, zone=None):
+    """Sum insured, premium and policy count of a province, or of one of its zones"""
+    sql = '''
+        SELECT COALESCE(SUM(SumInsured), 0), COALESCE(SUM(Premium), 0), COALESCE(SUM(PolicyCount), 0)
+        FROM ExposureAccumulations WHERE ProvinceID = ?
+    '''
+    params = [province_id or 0]
+    if zone is not None:
+        sql += ' AND Zone = ?'
+        params.append(normalize_zone(zone))
+    return tuple(conn.execute(sql, params).fetchone())
+
+
+def check_capacity(conn, province_id, zone, additional=0):
+    """List the capacities (zone, then whole province) that the totals plus `additional` exceed.
+
+    Each entry is (scope, MaxSumInsured, accumulated SumInsured).
+    """
+    return _exceeded(conn, province_id, zone, {'zone': additional, 'province': additional})
+
+
+def check_policy_change(conn, policy_id, province_id, zone, sum_insured):
+    """List the capacities a policy would exceed once it insures `sum_insured` in this province and zone.
+
+    What the policy already contributes is taken off the scopes it counts in,
+    so each capacity is checked with the policy's change in sum insured there.
+    Entries are as for check_capacity().
+    """
+    current = conn.execute('SELECT ProvinceID, Zone, SumInsured FROM ExposureContributions WHERE PolicyID = ?',
+                           (policy_id,)).fetchone()
+    in_province = current[2] if current and current[0] == (province_id or 0) else 0
+    in_zone = in_province if current and current[1] == normalize_zone(zone) else 0
+    return _exceeded(conn, province_id, zone,
+                     {'zone': sum_insured - in_zone, 'province': sum_insured - in_province})
+
+
+def _exceeded(conn, province_id, zone, additional):
+    exceeded = []
+    for scope, capacity_zone in (('zone', normalize_zone(zone)), ('province', '')):
+        if scope == 'zone' and not capacity_zone:
+            continue
+        capacity = conn.execute(
+            'SELECT MaxSumInsured FROM ExposureCapacities WHERE ProvinceID = ? AND Zone = ?',
+            (province_id or 0, capacity_zone)
+        ).fetchone()
+        if capacity is None:
+            continue
+
+        sum_insured = zone_totals(conn, province_id, capacity_zone if scope == 'zone' else None)[0]
+        if sum_insured + additional[scope] > capacity[0]:
+            exceeded.append((scope, capacity[0], sum_insured + additional[scope]))
+    return exceeded
@@ -0,0 +1,143 @@
+"""Fixed-point prime arithmetic.
+
+Amounts are integers in BIF minor units (ISO 4217 gives the franc no
+subdivision, so one unit is one franc). Tarif rates are percentages kept as
+integers scaled by RATE_SCALE.
+
+Rounding policy:
+- PN is rounded once from the exact product of ValeurAssure and the summed rates
+- FR, CD and TVA are each rounded from the already rounded components they apply to
+- All rounding is half-up, so PT = PN + FR + CD + TVA holds exactly
+- Each policy component is split across garantits pro rata to their tarif rate
+  by cumulative rounding: the garantits up to and including the i-th get
+  floor(total * their summed rate / all rates), and each garantit's share is
+  the difference from the previous one, so the shares always add up to the
+  total and leftover units go to the later garantits
+- The running sums of the rates are the same for every component, so they are
+  worked out once per set of rates and reused across components and policies
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+RATE_SCALE = 10000  # 4 decimal places on a percentage rate
+
+# (numerator, denominator) pairs for the premium components
+FRAIS_RATE = (8, 100)  # 8% of PN
+COMMISSION_RATE = (55, 1000)  # 5.5% of PN + FR
+TVA_RATE = (18, 100)  # 18% of PN + FR + CD
+
+_rate_units_cache = {}
+_rate_plans = {}
+
+
+def round_half_up(numerator, denominator):
+    """Divide two non-negative integers, rounding halves up"""
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def to_minor_units(value):
+    """Convert a BIF amount stored as REAL to integer francs"""
+    if not value:
+        return 0
+    if isinstance(value, int):
+        return value
+    if float(value).is_integer():
+        return int(value)
+    return int(Decimal(str(value)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def rate_to_units(rate):
+    """Convert a percentage tarif rate to integer RATE_SCALE units"""
+    units = _rate_units_cache.get(rate)
+    if units is None:
+        units = int((Decimal(str(rate or 0)) * RATE_SCALE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        _rate_units_cache[rate] = units
+    return units
+
+
+def _rate_plan(rates):
+    """Running sums of the rates in RATE_SCALE units, shared by every component"""
+    plan = _rate_plans.get(rates)
+    if plan is None:
+        plan = []
+        weight_sum = 0
+        for rate in rates:
+            weight_sum += rate_to_units(rate)
+            plan.append(weight_sum)
+        _rate_plans[rates] = plan
+    return plan
+
+
+def allocate(total, weights):
+    """Split an integer total across weights so the shares sum exactly to it"""
+    weight_sum = sum(weights)
+    if not weight_sum:
+        return [0] * len(weights)
+
+    shares = []
+    cumulative_weight = 0
+    allocated = 0
+    for weight in weights:
+        cumulative_weight += weight
+        cumulative_share = total * cumulative_weight // weight_sum
+        shares.append(cumulative_share - allocated)
+        allocated = cumulative_share
+
+    return shares
+
+
+def compute_prime(valeur_assure, garantits):
+    """Compute PN, FR, CD, TVA and PT in integer francs.
+
+    `garantits` is a list of (garantit_id, code, tarif_rate) tuples ordered by
+    GarantitID. Returns the policy totals, the summed rate in RATE_SCALE units
+    and the per-garantit breakdown.
+    """
+    plan = _rate_plan(tuple([rate for _, _, rate in garantits]))
+    weight_sum = plan[-1] if plan else 0
+
+    pn = round_half_up(valeur_assure * weight_sum, 100 * RATE_SCALE)
+    fr = round_half_up(pn * FRAIS_RATE[0], FRAIS_RATE[1])
+    cd = round_half_up((pn + fr) * COMMISSION_RATE[0], COMMISSION_RATE[1])
+    tva = round_half_up((pn + fr + cd) * TVA_RATE[0], TVA_RATE[1])
+
+    # Same allocation as allocate(), done for the four components in one pass
+    details = []
+    if weight_sum:
+        pn_0 = fr_0 = cd_0 = tva_0 = 0
+        for (garantit_id, code, rate), cumulative_weight in zip(garantits, plan):
+            pn_1 = pn * cumulative_weight // weight_sum
+            fr_1 = fr * cumulative_weight // weight_sum
+            cd_1 = cd * cumulative_weight // weight_sum
+            tva_1 = tva * cumulative_weight // weight_sum
+            garantit_pn = pn_1 - pn_0
+            garantit_fr = fr_1 - fr_0
+            garantit_cd = cd_1 - cd_0
+            garantit_tva = tva_1 - tva_0
+            details.append({
+                'garantit_id': garantit_id,
+                'code': code,
+                'tarif_rate': rate,
+                'pn': garantit_pn,
+                'fr': garantit_fr,
+                'cd': garantit_cd,
+                'tva': garantit_tva,
+                'pt': garantit_pn + garantit_fr + garantit_cd + garantit_tva
+            })
+            pn_0 = pn_1
+            fr_0 = fr_1
+            cd_0 = cd_1
+            tva_0 = tva_1
+    else:
+        for garantit_id, code, rate in garantits:
+            details.append({'garantit_id': garantit_id, 'code': code, 'tarif_rate': rate,
+                            'pn': 0, 'fr': 0, 'cd': 0, 'tva': 0, 'pt': 0})
+
+    return {
+        'pn': pn,
+        'fr': fr,
+        'cd': cd,
+        'tva': tva,
+        'pt': pn + fr + cd + tva,
+        'rate_units': weight_sum,
+        'garantit_details': details
+    }
@@ -0,0 +1,155 @@
+"""Read replica of the database for listing and reporting routes.
+
+A background thread copies the primary database into a replica file with
+SQLite's online backup API every `refresh_interval` seconds. The backup runs
+in small steps, so the primary is only read-locked for a few pages at a time
+and writers can commit in between. A write to the primary restarts a stepped
+backup, so when writes keep coming the copy is finished in one step after
+MAX_BACKUP_RESTARTS restarts. The copy is written to a temporary file of
+its own next to the replica and swapped in with os.replace, so connections
+already open on the old file are not affected.
+
+Every copy records the time it started in its ReplicaInfo table. Readers check
+that value in the file they opened, not a time kept in memory, so several
+server processes can share one replica: a process skips its refresh when
+another one has just replaced the file, and drops its copy instead of
+swapping it in when a newer one is already in place.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Pages copied per backup step, and the pause that lets writers in between steps
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+MAX_BACKUP_RESTARTS = 3
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _backup(source, target):
+    """Copy source into target in steps, in one step if writes keep restarting it"""
+    progress = {'remaining': None, 'restarts': 0}
+
+    def watch(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > MAX_BACKUP_RESTARTS:
+                raise _BackupRestarted()
+        progress['remaining'] = remaining
+
+    try:
+        source.backup(target, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, progress=watch)
+    except _BackupRestarted:
+        source.backup(target)
+
+
+def _copy_started_at(conn):
+    """Start time of the copy held by a replica connection, 0 when unknown"""
+    try:
+        row = conn.execute('SELECT RefreshedAt FROM ReplicaInfo').fetchone()
+    except sqlite3.Error:
+        return 0
+    return row[0] if row else 0
+
+
+class Replica:
+    def __init__(self, primary, path, refresh_interval, max_staleness):
+        self.primary = primary
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _open(self):
+        """Open the replica file read-only, None when there is no copy yet"""
+        try:
+            return sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        except sqlite3.Error:
+            return None
+
+    def refreshed_at(self):
+        """Start time of the copy now in the replica file, it has every write committed before it"""
+        conn = self._open()
+        if conn is None:
+            return 0
+        try:
+            return _copy_started_at(conn)
+        finally:
+            conn.close()
+
+    def refresh(self):
+        """Copy the primary database into the replica file"""
+        with self._lock:
+            started_at = time.time()
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.tmp', dir=directory)
+            os.close(fd)
+
+            try:
+                source = sqlite3.connect(self.primary)
+                target = sqlite3.connect(tmp_path)
+                try:
+                    _backup(source, target)
+                    target.execute('CREATE TABLE ReplicaInfo (RefreshedAt REAL NOT NULL)')
+                    target.execute('INSERT INTO ReplicaInfo (RefreshedAt) VALUES (?)', (started_at,))
+                    target.commit()
+                finally:
+                    target.close()
+                    source.close()
+
+                # Another process may have swapped in a copy started after this one
+                if self.refreshed_at() > started_at:
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def _run(self):
+        while True:
+            try:
+                # With several server processes, whichever wakes first refreshes for all of them
+                if time.time() - self.refreshed_at() >= self.refresh_interval:
+                    self.refresh()
+            except Exception:
+                # Readers fall back to the primary until a copy succeeds again
+                logger.exception('Refreshing the read replica %s failed', self.path)
+            time.sleep(self.refresh_interval)
+
+    def start(self):
+        """Start the background refresh thread once"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='replica-refresh', daemon=True)
+                    self._thread.start()
+
+    def connect(self, min_refreshed_at=0):
+        """Open the replica read-only, or return None if it is too stale for this reader.
+
+        `min_refreshed_at` is the time of the reader's own last write; the
+        replica is only used once a copy taken after that write is in place.
+        The copy's start time is read from the opened file itself, so it
+        matches the data this connection sees.
+        """
+        self.start()
+        conn = self._open()
+        if conn is None:
+            return None
+        refreshed_at = _copy_started_at(conn)
+        if refreshed_at < min_refreshed_at or time.time() - refreshed_at > self.max_staleness:
+            conn.close()
+            return None
+        return conn
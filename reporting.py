@@ -0,0 +1,191 @@
+"""Premium portfolio reports served from a columnar snapshot.
+
+The snapshot is built from an online backup of the live database into a
+temporary file in the snapshot directory, so the reporting join never runs against data.db
+itself and the copy is not held in memory. When the client books are sharded,
+every agency shard is copied too and queried with the shared copy attached.
+The snapshot is stored as one list per column in a gzip-compressed JSON file
+and aggregated in Python.
+"""
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+# Report dimension -> snapshot column
+DIMENSIONS = {
+    'product': 'ProductName',
+    'agency': 'AgencyName',
+    'courtier': 'CourtierName',
+    'province': 'ProvinceName',
+    'sous_type': 'SousTypeBienName'
+}
+
+MEASURES = ('PN', 'FR', 'CD', 'TVA', 'PT')
+
+# Latest prime calculation per policy, flattened with its report dimensions
+SNAPSHOT_QUERY = '''
+    SELECT p.PolicyID, p.Status, p.ProductionDate,
+           pr.ProductName, a.AgencyName, c.CourtierName,
+           pv.ProvinceName, stb.SousTypeBienName,
+           pc.PN, pc.FR, pc.CD, pc.TVA, pc.PT, pc.CalculatedAt
+    FROM (
+        SELECT PolicyID, MAX(PrimeID) AS PrimeID
+        FROM PrimeCalculations
+        GROUP BY PolicyID
+    ) latest
+    JOIN PrimeCalculations pc ON pc.PrimeID = latest.PrimeID
+    JOIN Policies p ON p.PolicyID = pc.PolicyID
+    JOIN Products pr ON p.ProductID = pr.ProductID
+    JOIN Agencies a ON p.AgencyID = a.AgencyID
+    LEFT JOIN Courtiers c ON p.CourtierID = c.CourtierID
+    LEFT JOIN PolicyParameters pp ON pp.ParamID = pc.ParamID
+    LEFT JOIN Provinces pv ON pp.ProvinceID = pv.ProvinceID
+    LEFT JOIN SousTypeBien stb ON pc.SousTypeBienID = stb.SousTypeBienID
+'''
+
+_snapshot_cache = {}
+_report_cache = {}
+
+
+def in_business_hours(business_hours, now=None):
+    """Check whether `now` falls inside the (start_hour, end_hour) window"""
+    now = now or datetime.now()
+    start_hour, end_hour = business_hours
+    return now.weekday() < 5 and start_hour <= now.hour < end_hour
+
+
+def backup_to_file(database, directory):
+    """Copy a database into a new temporary file of `directory`, returns its path"""
+    fd, copy_path = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    source = sqlite3.connect(database)
+    copy = sqlite3.connect(copy_path)
+    try:
+        try:
+            # The backup copies pages in steps, so writers are only paused briefly
+            source.backup(copy, pages=256)
+        finally:
+            source.close()
+            copy.close()
+    except BaseException:
+        os.remove(copy_path)
+        raise
+    return copy_path
+
+
+def _query_copy(copy_path, shared_copy_path=None):
+    copy = sqlite3.connect(copy_path)
+    try:
+        if shared_copy_path:
+            # Reference tables resolve to the shared copy, as on a live shard connection
+            copy.execute('ATTACH DATABASE ? AS shared', (shared_copy_path,))
+        cursor = copy.execute(SNAPSHOT_QUERY)
+        return [col[0] for col in cursor.description], cursor.fetchall()
+    finally:
+        copy.close()
+
+
+def build_snapshot(database, snapshot_path, shard_databases=()):
+    """Copy the live database (and its shards) to temporary files and write the flattened report columns"""
+    directory = os.path.dirname(snapshot_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    copy_path = backup_to_file(database, directory)
+    try:
+        if not shard_databases:
+            names, rows = _query_copy(copy_path)
+        else:
+            rows = []
+            for shard_database in shard_databases:
+                shard_copy_path = backup_to_file(shard_database, directory)
+                try:
+                    names, shard_rows = _query_copy(shard_copy_path, copy_path)
+                finally:
+                    os.remove(shard_copy_path)
+                rows.extend(shard_rows)
+    finally:
+        os.remove(copy_path)
+
+    columns = {name: [row[index] for row in rows] for index, name in enumerate(names)}
+    snapshot = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'row_count': len(rows),
+        'columns': columns
+    }
+
+    tmp_path = snapshot_path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    os.replace(tmp_path, snapshot_path)
+
+    return snapshot
+
+
+def load_snapshot(snapshot_path):
+    """Load the snapshot, reusing the parsed copy until the file changes"""
+    try:
+        mtime = os.path.getmtime(snapshot_path)
+    except OSError:
+        return None
+
+    cached = _snapshot_cache.get(snapshot_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with gzip.open(snapshot_path, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+
+    _snapshot_cache[snapshot_path] = (mtime, snapshot)
+    return snapshot
+
+
+def aggregate(snapshot, dimension):
+    """Sum the premium measures of the snapshot by one report dimension"""
+    columns = snapshot['columns']
+    keys = columns[DIMENSIONS[dimension]]
+    measure_columns = [columns[measure] for measure in MEASURES]
+
+    totals = {}
+    for index, key in enumerate(keys):
+        key = key or '---'
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = [0, 0, 0, 0, 0, 0]
+        entry[0] += 1
+        for position, values in enumerate(measure_columns, start=1):
+            entry[position] += values[index] or 0
+
+    rows = []
+    for key, entry in sorted(totals.items(), key=lambda item: item[1][5], reverse=True):
+        row = {'key': key, 'policies': entry[0]}
+        row.update(zip((measure.lower() for measure in MEASURES), entry[1:]))
+        rows.append(row)
+
+    return rows
+
+
+def premium_report(snapshot_path, dimension):
+    """Return the cached report for a dimension along with the snapshot timestamp"""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f'Unknown report dimension: {dimension}')
+
+    snapshot = load_snapshot(snapshot_path)
+    if snapshot is None:
+        return None
+
+    cache_key = (snapshot_path, snapshot['created_at'], dimension)
+    report = _report_cache.get(cache_key)
+    if report is None:
+        # Reports from older snapshots can never be served again
+        for key in [key for key in _report_cache if key[0] == snapshot_path and key[1] != snapshot['created_at']]:
+            del _report_cache[key]
+        report = {
+            'dimension': dimension,
+            'snapshot_created_at': snapshot['created_at'],
+            'rows': aggregate(snapshot, dimension)
+        }
+        _report_cache[cache_key] = report
+
+    return report
@@ -0,0 +1,242 @@
+"""Repositories for the client book aggregates.
+
+Each repository wraps a connection and returns sqlite3.Row rows: they are
+built in C, hold one tuple per row and share the column names of the whole
+result. A namedtuple row model built in Python was measured slower to fetch
+with no real memory saving, so callers use dict(row) only where they need a
+dict.
+
+Statement text is built once per (table, columns) and reused, and
+get_db_connection() keeps idle connections open per database, so repeated
+calls hit the statements sqlite3 caches per connection. get_many() pads its IN
+lists to a few fixed sizes, so only a handful of its statements are ever built.
+"""
+import sqlite3
+from functools import lru_cache
+
+# IN lists of get_many() are padded to one of these sizes
+IN_LIST_SIZES = (1, 8, 32, 128, 500)
+
+_columns = {}
+
+
+def table_columns(conn, table):
+    """Column names of a table, read once per process"""
+    if table not in _columns:
+        _columns[table] = [column[1] for column in conn.execute(f'PRAGMA table_info({table})')]
+    return _columns[table]
+
+
+@lru_cache(maxsize=None)
+def _select_sql(table, column, size=None):
+    if size is None:
+        return f'SELECT * FROM {table} WHERE {column} = ?'
+    return f"SELECT * FROM {table} WHERE {column} IN ({', '.join('?' * size)})"
+
+
+def _padded_chunks(keys):
+    """Split keys into IN lists of the sizes in IN_LIST_SIZES, as (size, keys) pairs"""
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), IN_LIST_SIZES[-1]):
+        chunk = keys[start:start + IN_LIST_SIZES[-1]]
+        size = next(size for size in IN_LIST_SIZES if size >= len(chunk))
+        # Repeating the last key fills the padding without changing the result
+        yield size, chunk + [chunk[-1]] * (size - len(chunk))
+
+
+@lru_cache(maxsize=None)
+def _insert_sql(table, columns):
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+@lru_cache(maxsize=None)
+def _update_sql(table, key, columns, updated_column):
+    assignments = [f'{column} = ?' for column in columns]
+    if updated_column:
+        assignments.append(f'{updated_column} = CURRENT_TIMESTAMP')
+    return f"UPDATE {table} SET {', '.join(assignments)} WHERE {key} = ?"
+
+
+@lru_cache(maxsize=None)
+def _delete_sql(table, key):
+    return f'DELETE FROM {table} WHERE {key} = ?'
+
+
+@lru_cache(maxsize=None)
+def _search_sql(table, columns):
+    return f"SELECT * FROM {table} WHERE {' OR '.join(f'{column} LIKE ?' for column in columns)}"
+
+
+class Repository:
+    table = None
+    key = None
+    # Column set to CURRENT_TIMESTAMP by update()
+    updated_column = None
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def query(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute(sql, params).fetchall()
+
+    def columns(self):
+        return table_columns(self.conn, self.table)
+
+    def count(self):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def all(self):
+        return self.query(f'SELECT * FROM {self.table}')
+
+    def get(self, key):
+        rows = self.query(_select_sql(self.table, self.key), (key,))
+        return rows[0] if rows else None
+
+    def get_many(self, keys, column=None):
+        """Rows whose `column` (the key by default) is in `keys`, in one statement per 500 keys"""
+        column = column or self.key
+        rows = []
+        for size, chunk in _padded_chunks(keys):
+            rows.extend(self.query(_select_sql(self.table, column, size), chunk))
+        return rows
+
+    def get_by_ids(self, keys):
+        """Rows of `keys` as a dict keyed by primary key"""
+        return {row[self.key]: row for row in self.get_many(keys)}
+
+    def insert(self, values):
+        """Insert a dict of column values (caller commits), returns the new rowid"""
+        columns = tuple(values)
+        cursor = self.conn.execute(_insert_sql(self.table, columns), tuple(values.values()))
+        return cursor.lastrowid
+
+    def update(self, key, values):
+        """Update a dict of column values of one row (caller commits)"""
+        columns = tuple(values)
+        self.conn.execute(_update_sql(self.table, self.key, columns, self.updated_column),
+                          tuple(values.values()) + (key,))
+
+    def delete(self, key):
+        """Delete one row (caller commits)"""
+        self.conn.execute(_delete_sql(self.table, self.key), (key,))
+
+
+class Clients(Repository):
+    table = 'Clients'
+    key = 'ID'
+
+    # Columns matched as substrings by each search type, anything else searches them all
+    SEARCH_COLUMNS = {
+        'nom': ('Nom',),
+        'prenom': ('Prenom',),
+        'mobphone': ('MobPhone', 'MobPhone2'),
+        'all': ('ID', 'Nom', 'Prenom', 'MobPhone', 'MobPhone2', 'Email', 'NIF', 'Residence'),
+    }
+
+    def page(self, limit, offset=0, newest_first=False):
+        order = 'DESC' if newest_first else 'ASC'
+        return self.query(f'SELECT * FROM Clients ORDER BY ID {order} LIMIT ? OFFSET ?', (limit, offset))
+
+    def search(self, search_type, text):
+        """Clients with ID `text` for the id search type (ValueError if not numeric), else matching it"""
+        if search_type == 'id':
+            return self.query(_select_sql(self.table, self.key), (int(text),))
+        columns = self.SEARCH_COLUMNS.get(search_type, self.SEARCH_COLUMNS['all'])
+        return self.query(_search_sql(self.table, columns), (f'%{text}%',) * len(columns))
+
+
+class Policies(Repository):
+    table = 'Policies'
+    key = 'PolicyID'
+    updated_column = 'UpdatedOn'
+
+    def page(self, limit, offset=0):
+        """Policies newest first, with their client, product, policy type and agency names"""
+        return self.query('''
+            SELECT p.*, c.Nom, c.Prenom, c.NIF, pr.ProductName,
+                   pt.TypeName as PolicyTypeName, a.AgencyName
+            FROM Policies p
+            JOIN Clients c ON p.ClientID = c.ID
+            JOIN Products pr ON p.ProductID = pr.ProductID
+            JOIN PolicyTypes pt ON p.PolicyTypeID = pt.TypeID
+            JOIN Agencies a ON p.AgencyID = a.AgencyID
+            ORDER BY p.CreatedOn DESC
+            LIMIT ? OFFSET ?
+        ''', (limit, offset))
+
+    def with_client(self, policy_id):
+        """The policy with its client's ID, Nom and Prenom"""
+        rows = self.query('''
+            SELECT p.*, c.ID, c.Nom, c.Prenom
+            FROM Policies p
+            JOIN Clients c ON p.ClientID = c.ID
+            WHERE p.PolicyID = ?
+        ''', (policy_id,))
+        return rows[0] if rows else None
+
+    def with_product(self, policy_id):
+        """The policy with its ProductName"""
+        rows = self.query('''
+            SELECT p.*, pr.ProductName
+            FROM Policies p
+            JOIN Products pr ON p.ProductID = pr.ProductID
+            WHERE p.PolicyID = ?
+        ''', (policy_id,))
+        return rows[0] if rows else None
+
+
+class PolicyParameters(Repository):
+    table = 'PolicyParameters'
+    key = 'ParamID'
+    updated_column = 'UpdatedAt'
+
+    def for_policy(self, policy_id):
+        """The parameter set of a policy (the first one when there are several)"""
+        rows = self.query('SELECT * FROM PolicyParameters WHERE PolicyID = ? ORDER BY ParamID LIMIT 1',
+                          (policy_id,))
+        return rows[0] if rows else None
+
+    def garantit_selection(self, param_id):
+        """GarantitID -> IsSelected of a parameter set"""
+        return dict(self.conn.execute('SELECT GarantitID, IsSelected FROM PolicyGarantits WHERE PolicyParamID = ?',
+                                      (param_id,)).fetchall())
+
+    def replace_garantit_selection(self, param_id, selection):
+        """Replace the garantit selection of a parameter set with GarantitID -> IsSelected (caller commits)"""
+        self.conn.execute('DELETE FROM PolicyGarantits WHERE PolicyParamID = ?', (param_id,))
+        self.conn.executemany('INSERT INTO PolicyGarantits (PolicyParamID, GarantitID, IsSelected) VALUES (?, ?, ?)',
+                              [(param_id, garantit_id, is_selected) for garantit_id, is_selected in selection.items()])
+
+
+class Tarifs(Repository):
+    table = 'Tarifs'
+    key = 'TarifID'
+    updated_column = 'UpdatedAt'
+
+    def set_rate(self, sous_type_bien_id, garantit_id, tarif_rate):
+        """Insert or update the rate of a (sous type, garantit) pair (caller commits)"""
+        self.conn.execute('''
+            INSERT INTO Tarifs (SousTypeBienID, GarantitID, TarifRate) VALUES (?, ?, ?)
+            ON CONFLICT(SousTypeBienID, GarantitID)
+            DO UPDATE SET TarifRate = excluded.TarifRate, UpdatedAt = CURRENT_TIMESTAMP
+        ''', (sous_type_bien_id, garantit_id, tarif_rate))
+
+
+class PrimeCalculations(Repository):
+    table = 'PrimeCalculations'
+    key = 'PrimeID'
+
+    def history(self, policy_id):
+        return self.query('SELECT * FROM PrimeCalculations WHERE PolicyID = ? ORDER BY PrimeID DESC',
+                          (policy_id,))
+
+    def details(self, prime_ids):
+        """PrimeDetails rows of the given calculations"""
+        return PrimeDetails(self.conn).get_many(prime_ids, column='PrimeID')
+
+
+class PrimeDetails(Repository):
+    table = 'PrimeDetails'
+    key = 'PrimeDetailID'
@@ -0,0 +1,226 @@
+"""Optional per-agency storage.
+
+Each agency gets its own SQLite file holding the client book (Clients,
+Policies, parameters and prime calculations). Reference tables stay in the
+shared database, which is attached to every shard connection as `shared`;
+unqualified table names resolve to the shard first and then to the shared
+database, so existing queries run unchanged.
+
+New rows get IDs starting at agency_id * SHARD_ID_SPAN, so the shard of an ID
+can be computed. Rows migrated from the single database keep their IDs, are
+recorded in the ShardDirectory table of the shared database and are removed
+from it, so the shards are the only copy of the client books.
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SHARD_ID_SPAN = 10 ** 9
+
+# Tables that live in the agency shards, in copy order
+SHARDED_TABLES = ('Clients', 'Policies', 'PolicyParameters', 'PolicyGarantits',
+                  'PrimeCalculations', 'PrimeDetails')
+
+# (table, key, keys now held by the shard) deleted from the shared database by split_database()
+MOVED_ROWS = (
+    ('PrimeDetails', 'PrimeID', 'SELECT PrimeID FROM main.PrimeCalculations'),
+    ('PrimeCalculations', 'PrimeID', 'SELECT PrimeID FROM main.PrimeCalculations'),
+    ('PolicyGarantits', 'PolicyParamID', 'SELECT ParamID FROM main.PolicyParameters'),
+    ('PolicyParameters', 'ParamID', 'SELECT ParamID FROM main.PolicyParameters'),
+    ('Policies', 'PolicyID', 'SELECT PolicyID FROM main.Policies'),
+    ('Clients', 'ID', 'SELECT ID FROM main.Clients'),
+)
+
+_initialized_shards = set()
+_init_lock = threading.Lock()
+_directory_cache = {}
+
+
+def shard_path(shard_dir, agency_id):
+    return os.path.join(shard_dir, f'agency_{int(agency_id)}.db')
+
+
+def shard_agencies(shard_dir):
+    """List the agencies that have a shard file"""
+    if not os.path.isdir(shard_dir):
+        return []
+
+    agencies = []
+    for name in os.listdir(shard_dir):
+        if name.startswith('agency_') and name.endswith('.db'):
+            agencies.append(int(name[len('agency_'):-len('.db')]))
+    return sorted(agencies)
+
+
+def ensure_directory(shared_conn):
+    shared_conn.execute('''
+        CREATE TABLE IF NOT EXISTS ShardDirectory (
+            EntityType TEXT NOT NULL,
+            EntityID INTEGER NOT NULL,
+            AgencyID INTEGER NOT NULL,
+            PRIMARY KEY (EntityType, EntityID)
+        )
+    ''')
+
+
+def _init_shard(conn, agency_id):
+    """Create the sharded tables from the shared schema and seed their ID ranges"""
+    base_id = int(agency_id) * SHARD_ID_SPAN
+
+    for table in SHARDED_TABLES:
+        row = conn.execute(
+            "SELECT sql FROM shared.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        sql = row[0]
+        if table == 'Clients':
+            # Clients has a plain rowid key, AUTOINCREMENT lets us seed its range
+            sql = sql.replace('PRIMARY KEY("ID")', 'PRIMARY KEY("ID" AUTOINCREMENT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS main.' + sql[len('CREATE TABLE '):])
+
+    for table in SHARDED_TABLES:
+        seq = conn.execute('SELECT seq FROM main.sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if seq is None:
+            has_sequence = conn.execute(
+                "SELECT sql LIKE '%AUTOINCREMENT%' FROM main.sqlite_master WHERE name = ?", (table,)
+            ).fetchone()[0]
+            if has_sequence:
+                conn.execute('INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)', (table, base_id))
+        elif seq[0] < base_id:
+            conn.execute('UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?', (base_id, table))
+
+    conn.commit()
+
+
+def connect_shard(shard_dir, agency_id, shared_database, check_same_thread=True):
+    """Open the shard of an agency with the shared database attached"""
+    path = shard_path(shard_dir, agency_id)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.execute('ATTACH DATABASE ? AS shared', (shared_database,))
+
+    if path not in _initialized_shards:
+        with _init_lock:
+            if path not in _initialized_shards:
+                _init_shard(conn, agency_id)
+                _initialized_shards.add(path)
+
+    return conn
+
+
+def locate(shared_database, entity_type, entity_id):
+    """Find the agency shard holding a client or policy"""
+    entity_id = int(entity_id)
+    if entity_id >= SHARD_ID_SPAN:
+        return entity_id // SHARD_ID_SPAN
+
+    key = (shared_database, entity_type, entity_id)
+    if key in _directory_cache:
+        return _directory_cache[key]
+
+    conn = sqlite3.connect(shared_database)
+    try:
+        ensure_directory(conn)
+        row = conn.execute(
+            'SELECT AgencyID FROM ShardDirectory WHERE EntityType = ? AND EntityID = ?',
+            (entity_type, entity_id)
+        ).fetchone()
+    finally:
+        conn.close()
+
+    agency_id = row[0] if row else None
+    if agency_id is not None:
+        _directory_cache[key] = agency_id
+    return agency_id
+
+
+def fan_out(shard_dir, shared_database, read):
+    """Run `read(conn)` on every shard in parallel and concatenate the rows it returns"""
+    agencies = shard_agencies(shard_dir)
+    if not agencies:
+        return []
+
+    def query(agency_id):
+        conn = connect_shard(shard_dir, agency_id, shared_database)
+        conn.row_factory = sqlite3.Row
+        try:
+            return read(conn)
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=min(8, len(agencies))) as pool:
+        results = list(pool.map(query, agencies))
+
+    return [row for rows in results for row in rows]
+
+
+def split_database(shared_database, shard_dir, default_agency_id=1):
+    """Move the client books of the single database into agency shards.
+
+    A client lives in the shard of the agency of its latest policy, or of its
+    BranchID when that is an agency, or of `default_agency_id`. Policies and
+    everything hanging off them follow their client, and each agency's rows are
+    deleted from the shared database in the transaction that copies them. A
+    re-run only moves rows still in the shared database; a row whose ID already
+    exists in the shard fails the move instead of overwriting it. Returns the
+    number of clients moved per agency.
+    """
+    source = sqlite3.connect(shared_database)
+    try:
+        ensure_directory(source)
+        agencies = {row[0] for row in source.execute('SELECT AgencyID FROM Agencies')}
+
+        homes = {}
+        for client_id, branch_id in source.execute('SELECT ID, BranchID FROM Clients'):
+            homes[client_id] = branch_id if branch_id in agencies else default_agency_id
+        for client_id, agency_id in source.execute(
+                'SELECT ClientID, AgencyID FROM Policies ORDER BY CreatedOn, PolicyID'):
+            homes[client_id] = agency_id
+
+        moved = {}
+        for agency_id in sorted(set(homes.values())):
+            client_ids = [client_id for client_id, home in homes.items() if home == agency_id]
+            conn = connect_shard(shard_dir, agency_id, shared_database)
+            try:
+                conn.execute('CREATE TEMP TABLE MovedClients (ID INTEGER PRIMARY KEY)')
+                conn.executemany('INSERT INTO MovedClients (ID) VALUES (?)', [(cid,) for cid in client_ids])
+
+                conn.execute('INSERT INTO main.Clients SELECT * FROM shared.Clients '
+                             'WHERE ID IN (SELECT ID FROM MovedClients)')
+                conn.execute('INSERT INTO main.Policies SELECT * FROM shared.Policies '
+                             'WHERE ClientID IN (SELECT ID FROM MovedClients)')
+                conn.execute('INSERT INTO main.PolicyParameters SELECT * FROM shared.PolicyParameters '
+                             'WHERE PolicyID IN (SELECT PolicyID FROM main.Policies)')
+                conn.execute('INSERT INTO main.PolicyGarantits SELECT * FROM shared.PolicyGarantits '
+                             'WHERE PolicyParamID IN (SELECT ParamID FROM main.PolicyParameters)')
+                conn.execute('INSERT INTO main.PrimeCalculations SELECT * FROM shared.PrimeCalculations '
+                             'WHERE PolicyID IN (SELECT PolicyID FROM main.Policies)')
+                conn.execute('INSERT INTO main.PrimeDetails SELECT * FROM shared.PrimeDetails '
+                             'WHERE PrimeID IN (SELECT PrimeID FROM main.PrimeCalculations)')
+
+                conn.execute('''
+                    INSERT OR REPLACE INTO shared.ShardDirectory (EntityType, EntityID, AgencyID)
+                    SELECT 'Client', ID, ? FROM main.Clients WHERE ID < ?
+                    UNION ALL
+                    SELECT 'Policy', PolicyID, ? FROM main.Policies WHERE PolicyID < ?
+                ''', (agency_id, SHARD_ID_SPAN, agency_id, SHARD_ID_SPAN))
+
+                # Children first, each keyed by what is now in the shard
+                for table, key, moved_keys in MOVED_ROWS:
+                    conn.execute(f'DELETE FROM shared.{table} WHERE {key} IN ({moved_keys})')
+                has_latest = conn.execute(
+                    "SELECT 1 FROM shared.sqlite_master WHERE type = 'table' AND name = 'LatestPrimeCalculations'"
+                ).fetchone()
+                if has_latest:
+                    conn.execute('DELETE FROM shared.LatestPrimeCalculations '
+                                 'WHERE PolicyID IN (SELECT PolicyID FROM main.Policies)')
+                conn.commit()
+            finally:
+                conn.close()
+            moved[agency_id] = len(client_ids)
+    finally:
+        source.close()
+
+    _directory_cache.clear()
+    return moved
@@ -26,31 +26,65 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+// Reference data bundle, kept in localStorage until its versioned URL changes
+const REFERENCE_DATA_KEY = 'bicor-reference-data';
+
+function loadReferenceData(url) {
+    try {
+        const cached = JSON.parse(localStorage.getItem(REFERENCE_DATA_KEY));
+        if (cached && cached.url === url) {
+            return Promise.resolve(cached.data);
+        }
+    } catch (error) {
+        // Unreadable cache entry, fetch a fresh copy
+    }
+
+    return fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            try {
+                localStorage.setItem(REFERENCE_DATA_KEY, JSON.stringify({ url: url, data: data }));
+            } catch (error) {
+                // Storage full or disabled, the browser HTTP cache still applies
+            }
+            return data;
+        });
+}
+
+function fillSousTypeOptions(sousTypeSelect, sousTypes) {
+    sousTypeSelect.innerHTML = '<option value="">Select Sous Type Bien</option>';
+    sousTypes.forEach(sousType => {
+        const option = document.createElement('option');
+        option.value = sousType.SousTypeBienID;
+        option.textContent = sousType.SousTypeBienName;
+        sousTypeSelect.appendChild(option);
+    });
+}
+
 // Dynamic sous type loading
 function initSousTypeDropdown() {
     const typeBienSelect = document.getElementById('TypeBienID');
     const sousTypeSelect = document.getElementById('SousTypeBienID');
 
     if (typeBienSelect && sousTypeSelect) {
+        const referenceUrl = typeBienSelect.dataset.referenceUrl;
+        const referenceData = referenceUrl ? loadReferenceData(referenceUrl) : null;
+
         typeBienSelect.addEventListener('change', function() {
             const typeBienID = this.value;
 
-            if (typeBienID) {
-                fetch(`/api/sous-types/${typeBienID}`)
-                    .then(response => response.json())
-                    .then(data => {
-                        sousTypeSelect.innerHTML = '<option value="">Select Sous Type Bien</option>';
-                        data.forEach(sousType => {
-                            const option = document.createElement('option');
-                            option.value = sousType.SousTypeBienID;
-                            option.textContent = sousType.SousTypeBienName;
-                            sousTypeSelect.appendChild(option);
-                        });
-                    })
-                    .catch(error => console.error('Error loading sous types:', error));
-            } else {
-                sousTypeSelect.innerHTML = '<option value="">Select Sous Type Bien</option>';
+            if (!typeBienID) {
+                fillSousTypeOptions(sousTypeSelect, []);
+                return;
             }
+
+            const sousTypes = referenceData
+                ? referenceData.then(data => data.sous_types_by_parent[typeBienID] || [])
+                : fetch(`/api/sous-types/${typeBienID}`).then(response => response.json());
+
+            sousTypes
+                .then(data => fillSousTypeOptions(sousTypeSelect, data))
+                .catch(error => console.error('Error loading sous types:', error));
         });
     }
 }
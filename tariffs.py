@@ -0,0 +1,129 @@
+"""Effective-dated tarif versions.
+
+Every change of a TarifRate is a new row in TarifVersions with the date it
+takes effect; a version applies until the next version of the same
+(SousTypeBienID, GarantitID) starts. The Tarifs table keeps holding the
+current rate for screens that only need today's tarif.
+
+Tarifs stays the source of today's rates: every load of the index first gives
+each Tarifs pair without a version one that applies to all history, and
+carries a rate edited directly in Tarifs into the version in effect today.
+
+TarifIndex loads all versions into sorted date lists so the applicable rate
+for a date is found with a binary search instead of date-range SQL.
+"""
+from bisect import bisect_right
+
+import repositories
+
+# Versions seeded from the Tarifs table apply to all history
+EARLIEST_DATE = '0001-01-01'
+
+
+def ensure_schema(conn):
+    """Create TarifVersions"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TarifVersions (
+            TarifVersionID INTEGER PRIMARY KEY AUTOINCREMENT,
+            SousTypeBienID INTEGER NOT NULL,
+            GarantitID INTEGER NOT NULL,
+            TarifRate REAL NOT NULL,
+            EffectiveFrom TEXT NOT NULL,
+            CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(SousTypeBienID, GarantitID, EffectiveFrom),
+            FOREIGN KEY (SousTypeBienID) REFERENCES SousTypeBien(SousTypeBienID),
+            FOREIGN KEY (GarantitID) REFERENCES Garantits(GarantitID)
+        )
+    ''')
+    conn.commit()
+
+
+def sync_from_tarifs(conn, today):
+    """Version the Tarifs pairs that have none and apply direct Tarifs edits to today's versions"""
+    ensure_schema(conn)
+    conn.execute('''
+        INSERT INTO TarifVersions (SousTypeBienID, GarantitID, TarifRate, EffectiveFrom)
+        SELECT t.SousTypeBienID, t.GarantitID, t.TarifRate, ? FROM Tarifs t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM TarifVersions v
+            WHERE v.SousTypeBienID = t.SousTypeBienID AND v.GarantitID = t.GarantitID
+        )
+    ''', (EARLIEST_DATE,))
+
+    edited = conn.execute('''
+        SELECT v.TarifVersionID, t.TarifRate
+        FROM Tarifs t
+        JOIN TarifVersions v ON v.TarifVersionID = (
+            SELECT TarifVersionID FROM TarifVersions
+            WHERE SousTypeBienID = t.SousTypeBienID AND GarantitID = t.GarantitID AND EffectiveFrom <= ?
+            ORDER BY EffectiveFrom DESC LIMIT 1
+        )
+        WHERE v.TarifRate != t.TarifRate
+    ''', (today,)).fetchall()
+    conn.executemany('UPDATE TarifVersions SET TarifRate = ? WHERE TarifVersionID = ?',
+                     [(tarif_rate, version_id) for version_id, tarif_rate in edited])
+    conn.commit()
+
+
+def add_version(conn, sous_type_bien_id, garantit_id, tarif_rate, effective_from, today):
+    """Record a new tarif rate from `effective_from`, updating Tarifs when it is already in effect"""
+    # The earlier history of a pair comes from Tarifs, so it needs its version first
+    sync_from_tarifs(conn, today)
+    conn.execute('''
+        INSERT OR REPLACE INTO TarifVersions (SousTypeBienID, GarantitID, TarifRate, EffectiveFrom)
+        VALUES (?, ?, ?, ?)
+    ''', (sous_type_bien_id, garantit_id, tarif_rate, effective_from))
+
+    current = conn.execute('''
+        SELECT TarifRate FROM TarifVersions
+        WHERE SousTypeBienID = ? AND GarantitID = ? AND EffectiveFrom <= ?
+        ORDER BY EffectiveFrom DESC LIMIT 1
+    ''', (sous_type_bien_id, garantit_id, today)).fetchone()
+    if current:
+        repositories.Tarifs(conn).set_rate(sous_type_bien_id, garantit_id, current[0])
+
+    conn.commit()
+
+
+class TarifIndex:
+    """Point-in-time tarif rate lookup"""
+
+    def __init__(self, versions):
+        # (SousTypeBienID, GarantitID) -> ([EffectiveFrom, ...], [TarifRate, ...]) sorted by date
+        grouped = {}
+        for sous_type_bien_id, garantit_id, effective_from, tarif_rate in versions:
+            grouped.setdefault((sous_type_bien_id, garantit_id), []).append((effective_from, tarif_rate))
+
+        self._versions = {}
+        for key, entries in grouped.items():
+            entries.sort()
+            self._versions[key] = ([date for date, _ in entries], [rate for _, rate in entries])
+
+    @classmethod
+    def load(cls, conn, today):
+        sync_from_tarifs(conn, today)
+        return cls(conn.execute(
+            'SELECT SousTypeBienID, GarantitID, EffectiveFrom, TarifRate FROM TarifVersions'
+        ).fetchall())
+
+    def rate_at(self, sous_type_bien_id, garantit_id, on_date):
+        """Rate in effect on `on_date` (ISO date), None when there is no tarif yet"""
+        versions = self._versions.get((sous_type_bien_id, garantit_id))
+        if versions is None:
+            return None
+
+        dates, rates = versions
+        position = bisect_right(dates, on_date) - 1
+        if position < 0:
+            return None
+        return rates[position]
+
+    def garantits_in_effect(self, on_date):
+        """SousTypeBienID -> sorted GarantitIDs that have a rate on `on_date`"""
+        garantits = {}
+        for (sous_type_bien_id, garantit_id), (dates, _) in self._versions.items():
+            if dates[0] <= on_date:
+                garantits.setdefault(sous_type_bien_id, []).append(garantit_id)
+        for garantit_ids in garantits.values():
+            garantit_ids.sort()
+        return garantits
@@ -0,0 +1,29 @@
+import duplicates
+
+
+def client(client_id, nif='', nom='', prenom='', phone='', phone2=''):
+    return {'ID': client_id, 'NIF': nif, 'Nom': nom, 'Prenom': prenom, 'MobPhone': phone, 'MobPhone2': phone2}
+
+
+def test_exact_nif_match_is_a_duplicate_on_its_own():
+    a = duplicates.profile(client(1, nif='4000123456', nom='NDAYISHIMIYE', prenom='Jean'))
+    b = duplicates.profile(client(2, nif='4000-123-456', nom='BIGIRIMANA', prenom='Alice'))
+    pair_score, reasons = duplicates.score(a, b)
+    assert reasons == ['nif']
+    assert pair_score >= duplicates.DUPLICATE_THRESHOLD
+
+
+def test_placeholder_nif_is_not_a_match():
+    a = duplicates.profile(client(1, nif='0000', nom='NDAYISHIMIYE', prenom='Jean'))
+    b = duplicates.profile(client(2, nif='0000', nom='BIGIRIMANA', prenom='Alice'))
+    assert duplicates.score(a, b) == (0, [])
+
+
+def test_phone_or_name_alone_is_not_a_duplicate():
+    a = duplicates.profile(client(1, nom='NDAYISHIMIYE', prenom='Jean', phone='+257 79 123 456'))
+    phone_only = duplicates.profile(client(2, nom='BIGIRIMANA', prenom='Alice', phone='79123456'))
+    name_only = duplicates.profile(client(3, nom='Jean', prenom='NDAYISHIMIYE'))
+    assert duplicates.score(a, phone_only)[0] < duplicates.DUPLICATE_THRESHOLD
+    assert duplicates.score(a, name_only)[0] < duplicates.DUPLICATE_THRESHOLD
+    both = duplicates.profile(client(4, nom='NDAYISHIMIYE', prenom='Jean', phone='79123456'))
+    assert duplicates.score(a, both)[0] >= duplicates.DUPLICATE_THRESHOLD
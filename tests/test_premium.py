@@ -0,0 +1,77 @@
+import random
+
+import premium
+
+
+def test_round_half_up():
+    assert premium.round_half_up(5, 10) == 1
+    assert premium.round_half_up(4, 10) == 0
+    assert premium.round_half_up(15, 10) == 2
+    assert premium.round_half_up(25, 10) == 3
+    assert premium.round_half_up(0, 7) == 0
+    assert premium.round_half_up(7, 7) == 1
+
+
+def test_allocate_shares_sum_to_total():
+    rng = random.Random(1)
+    for _ in range(500):
+        total = rng.randrange(0, 10 ** 9)
+        weights = [rng.randrange(0, 50000) for _ in range(rng.randrange(1, 10))]
+        shares = premium.allocate(total, weights)
+        assert len(shares) == len(weights)
+        if sum(weights):
+            assert sum(shares) == total
+            assert all(share >= 0 for share in shares)
+            # Every share is within one unit of its exact pro rata amount
+            for share, weight in zip(shares, weights):
+                assert abs(share * sum(weights) - total * weight) < sum(weights)
+
+
+def test_allocate_leftover_goes_to_later_weights():
+    assert premium.allocate(10, [1, 1, 1]) == [3, 3, 4]
+    assert premium.allocate(2, [1, 1, 1]) == [0, 1, 1]
+    assert premium.allocate(7, [2, 0, 5]) == [2, 0, 5]
+
+
+def test_allocate_without_weights():
+    assert premium.allocate(100, [0, 0]) == [0, 0]
+    assert premium.allocate(100, []) == []
+
+
+def test_compute_prime_totals():
+    prime = premium.compute_prime(10000000, [(1, 'INC', 0.5), (2, 'VOL', 0.25)])
+    assert prime['pn'] == 75000
+    assert prime['fr'] == 6000
+    assert prime['cd'] == 4455
+    assert prime['tva'] == 15382
+    assert prime['pt'] == 75000 + 6000 + 4455 + 15382
+    assert prime['rate_units'] == 7500
+
+
+def test_compute_prime_details_add_up_to_totals():
+    rng = random.Random(2)
+    rates = [0.05, 0.1, 0.125, 0.2, 0.3, 0.333, 1.1, 1.25, 2.0, 4.0]
+    for _ in range(500):
+        garantits = [(garantit_id, f'G{garantit_id}', rng.choice(rates))
+                     for garantit_id in range(1, rng.randrange(2, 9))]
+        prime = premium.compute_prime(rng.randrange(1, 2 * 10 ** 9), garantits)
+        details = prime['garantit_details']
+        for component in ('pn', 'fr', 'cd', 'tva', 'pt'):
+            assert sum(detail[component] for detail in details) == prime[component]
+        for detail in details:
+            assert detail['pt'] == detail['pn'] + detail['fr'] + detail['cd'] + detail['tva']
+            assert min(detail['pn'], detail['fr'], detail['cd'], detail['tva']) >= 0
+
+
+def test_compute_prime_matches_allocate():
+    garantits = [(1, 'INC', 0.3), (2, 'VOL', 0.3), (3, 'DDE', 0.4)]
+    prime = premium.compute_prime(123456789, garantits)
+    weights = [premium.rate_to_units(rate) for _, _, rate in garantits]
+    for component in ('pn', 'fr', 'cd', 'tva'):
+        assert [detail[component] for detail in prime['garantit_details']] == premium.allocate(prime[component], weights)
+
+
+def test_compute_prime_without_rates():
+    prime = premium.compute_prime(5000000, [(1, 'INC', 0), (2, 'VOL', None)])
+    assert prime['pt'] == 0
+    assert [detail['pt'] for detail in prime['garantit_details']] == [0, 0]
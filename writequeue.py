@@ -0,0 +1,161 @@
+"""Group commit of low-criticality writes.
+
+Writes are handed to a single writer thread as functions taking a
+connection. The thread gathers whatever arrives within `max_delay` seconds,
+up to `max_batch` writes, and applies them in one transaction. A busy
+server then pays for one commit (and one fsync) per batch instead of one
+per request, and its request threads no longer queue up on the database
+lock.
+
+Each write runs inside its own savepoint, so a failing write is rolled back
+and reported to its submitter without affecting the rest of the batch.
+submit() returns a Future that resolves once the batch holding the write
+has committed; waiting on it gives the same durability as a direct commit.
+The queue holds at most `max_pending` writes; submit() blocks for up to
+`put_timeout` seconds when it is full and then raises queue.Full, so callers
+can fall back to writing directly. A write whose Future is cancelled before
+its batch starts is skipped, which lets a submitter that gave up waiting write
+directly instead. If the writer thread itself fails (e.g. it cannot open its
+connection), the queue closes and every pending write fails with QueueClosed.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class GroupCommitQueue:
+    def __init__(self, connect, max_batch=500, max_delay=0.005, max_pending=10000, put_timeout=5):
+        # `connect` opens the writer's connection, it is called on the writer thread
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.committed = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        """Start the writer thread once"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                    self._thread.start()
+
+    def submit(self, write, *args):
+        """Queue `write(conn, *args)`, returns a Future of its result, set after commit"""
+        if self._closed:
+            raise QueueClosed('write queue is closed')
+        self.start()
+        future = Future()
+        self._queue.put((write, args, future), timeout=self.put_timeout)
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until every write submitted so far has been committed"""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=30):
+        """Commit what is queued, then stop the writer thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        conn = None
+        try:
+            conn = self.connect()
+            # Transactions are managed here, not by the sqlite3 module
+            conn.isolation_level = None
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                self._commit(conn, batch)
+        except Exception as error:
+            logger.exception('Group commit writer stopped')
+            self._fail_pending(error)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _fail_pending(self, error):
+        """Close the queue and fail every write still waiting in it"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[2].set_running_or_notify_cancel():
+                item[2].set_exception(QueueClosed(f'write queue writer stopped: {error!r}'))
+
+    def _commit(self, conn, batch):
+        # Writes cancelled by their submitter are left out
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write, args, future in batch:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    outcomes.append((future, write(conn, *args), None))
+                    conn.execute('RELEASE queued_write')
+                except Exception as error:
+                    conn.execute('ROLLBACK TO queued_write')
+                    conn.execute('RELEASE queued_write')
+                    outcomes.append((future, None, error))
+            conn.execute('COMMIT')
+        except Exception as error:
+            # Nothing of the batch was stored
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            finally:
+                for _, _, future in batch:
+                    future.set_exception(error)
+            return
+
+        self.committed += len(batch)
+        self.batches += 1
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)